@@ -1,50 +1,125 @@
-import json
-from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import closing
 
-from pydantic import BaseSettings, PostgresDsn, RedisDsn, AnyHttpUrl
-
-from etl.etl import movie_etl
+from etl.backfill import backfill
+from etl.coordinator import LeaseCoordinator
+from etl.etl import index_targets, movie_etl
+from etl.loders.sinks import make_sink
+from etl.profiling import Profiler
+from etl.supervisor import Supervisor
+from etl.verifier import verify
 from etl.extractors.filmwork_extractor import FilmworkExtractor
 from etl.extractors.genre_extractor import GenreExtractor
 from etl.extractors.person_extractor import PersonExtractor
 from helpers.logger import LoggerFactory
-from storage_clients.elasticsearch_client import ElasticsearchClient
+from settings import Settings
 
 logger = LoggerFactory().get_logger()
 
+PIPELINES = {
+    'genre_data': GenreExtractor,
+    'person_data': PersonExtractor,
+    'film_work_data': FilmworkExtractor,
+}
+
+
+def log_crash(state_key: str, future: Future) -> None:
+    """Done callback of a pipeline thread: pipelines run forever, so any exit but cancellation is a crash."""
+    if future.cancelled():
+        logger.warning("Pipeline `%s` was cancelled.", state_key)
+        return
+
+    if exc := future.exception():
+        logger.critical("Pipeline `%s` crashed with `%r`", state_key, exc, exc_info=exc)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Postgres to Elasticsearch ETL")
+    commands = parser.add_subparsers(dest='command')
+
+    backfill_parser = commands.add_parser('backfill', help="replay `updated_at` range of a pipeline in parallel")
+    backfill_parser.add_argument('pipeline', choices=PIPELINES)
+    backfill_parser.add_argument('since', type=datetime.datetime.fromisoformat)
+    backfill_parser.add_argument('until', type=datetime.datetime.fromisoformat)
+    backfill_parser.add_argument('--slices', type=int, default=8)
+    backfill_parser.add_argument('--workers', type=int, default=4)
 
-class Settings(BaseSettings):
-    pg_dsn: PostgresDsn
-    extract_chunk: int
-    redis_dsn: RedisDsn
-    elk_dsn: AnyHttpUrl
-    elk_index: str
-    load_chunk: int
+    verify_parser = commands.add_parser('verify', help="find and requeue filmworks index drifted from PGSQL")
+    verify_parser.add_argument('--parts', type=int, default=256, help="id ranges verified in parallel")
+    verify_parser.add_argument('--workers', type=int, default=4)
+    verify_parser.add_argument('--rate', type=float, default=20, help="max queries per second, 0 means no limit")
+    verify_parser.add_argument('--leaf-size', type=int, default=1000, help="range size compared id by id")
+    verify_parser.add_argument('--dry-run', action='store_true', help="report drift only")
 
-    class Config:
-        case_sensitive = False
-        env_file = '.env'
-        env_file_encoding = 'utf-8'
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     settings = Settings()
 
-    with closing(ElasticsearchClient(settings.elk_dsn)) as elk_conn:
-        if not elk_conn.index_exists(settings.elk_index):
-            logger.warn("ELK index `%s` is missing", settings.elk_index)
-            with open('postgres_to_es/index.json', 'r') as f:
-                data = json.load(f)
-                elk_conn.index_create(settings.elk_index, body=data)
+    LoggerFactory().configure(
+        level=settings.log_level,
+        json_format=settings.log_json,
+        use_queue=settings.log_queue,
+        rate_limit_burst=settings.log_rate_limit_burst,
+        rate_limit_period=settings.log_rate_limit_period,
+    )
+
+    with closing(make_sink(settings, 'init')) as sink:
+        for target in index_targets(settings):
+            sink.ensure_index(target.index, target.mapping_file)
+
+    if args.command == 'backfill':
+        backfill(
+            settings, PIPELINES[args.pipeline], args.pipeline, args.since, args.until, args.slices, args.workers
+        )
+        return
+
+    if args.command == 'verify':
+        verify(settings, args.parts, args.workers, args.rate, args.leaf_size, args.dry_run)
+        return
+
+    if settings.supervisor:
+        Supervisor(
+            settings,
+            PIPELINES,
+            settings.pipeline_workers,
+            restart_backoff_start=settings.restart_backoff_start,
+            restart_backoff_max=settings.restart_backoff_max,
+            shutdown_timeout=settings.shutdown_timeout,
+        ).run()
+        return
+
+    profiler = Profiler(settings.profile_dir, settings.profile_seconds, settings.profile_interval)
+    if settings.profile_signals:
+        profiler.install_signal()
+    if settings.profile_admin_port:
+        profiler.serve(settings.profile_admin_port)
+
+    limiter = threading.BoundedSemaphore(settings.etl_concurrency) if settings.etl_concurrency else None
 
-            logger.warn("ELK index `%s` created", settings.elk_index)
+    if settings.lease:
+        LeaseCoordinator(
+            settings,
+            PIPELINES,
+            settings.pipeline_workers,
+            ttl=settings.lease_ttl,
+            heartbeat=settings.lease_heartbeat,
+            limiter=limiter,
+        ).run()
+        return
 
     with ThreadPoolExecutor() as pool:
-        pool.submit(movie_etl, settings, GenreExtractor, 'genre_data')
-        pool.submit(movie_etl, settings, PersonExtractor, 'person_data')
-        pool.submit(movie_etl, settings, FilmworkExtractor, 'film_work_data')
+        for state_key, extractor_type in PIPELINES.items():
+            future = pool.submit(movie_etl, settings, extractor_type, state_key, limiter)
+            future.add_done_callback(functools.partial(log_crash, state_key))
         logger.critical("ETL started")
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Type
+
+from etl.etl import etl_pipeline
+from etl.extractors.base_filmwork_extractor import BaseFilmworkExtractor
+from helpers.logger import LoggerFactory
+
+logger = LoggerFactory().get_logger()
+
+
+def split_range(
+    since: datetime.datetime, until: datetime.datetime, slices: int
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """Split `(since, until]` range of `updated_at` to equal time slices."""
+    step = (until - since) / slices
+    bounds = [since + step * i for i in range(slices)] + [until]
+
+    return list(zip(bounds, bounds[1:]))
+
+
+def caught_up(horizon: datetime.datetime | None, until: datetime.datetime) -> bool:
+    """Whether produce loop read up to `until`, naive one is compared in PGSQL session time zone `horizon` is in."""
+    if horizon is None:
+        return True
+
+    if until.tzinfo is None:
+        horizon = horizon.replace(tzinfo=None)
+
+    return horizon >= until
+
+
+def backfill_slice(
+    settings,
+    extractor_type: Type[BaseFilmworkExtractor],
+    state_key: str,
+    since: datetime.datetime,
+    until: datetime.datetime,
+) -> int:
+    """Run one pass over a slice with its own checkpoint, finished slice is marked by checkpoint set to its end."""
+    with etl_pipeline(settings, extractor_type, state_key, since=since, until=until) as extractor:
+        if extractor.state.get().updated_at == str(until):
+            logger.info("Backfill slice `%s` is already finished.", state_key)
+            return 0
+
+        produced = extractor.extract()
+        while not caught_up(extractor.horizon, until):
+            # replica has not caught up with the slice end yet, rows after its horizon are not produced
+            logger.info("Backfill slice `%s` is read up to `%s`, waiting for replica.", state_key, extractor.horizon)
+            time.sleep(settings.poll_min_interval)
+            produced += extractor.extract()
+
+        extractor.state.set(str(until))
+        logger.warn("Backfill slice `%s` finished, produced `%s` rows.", state_key, produced)
+
+        return produced
+
+
+def backfill(
+    settings,
+    extractor_type: Type[BaseFilmworkExtractor],
+    state_key: str,
+    since: datetime.datetime,
+    until: datetime.datetime,
+    slices: int,
+    workers: int,
+) -> None:
+    """
+    Replay `(since, until]` range of `updated_at` of a pipeline by slices on a pool of workers.
+    Slice checkpoints are keyed by range, so interrupted backfill resumes when run with the same arguments.
+    Live pipeline checkpoint is not touched.
+    """
+    key_prefix = f"{state_key}:backfill:{since.isoformat()}:{until.isoformat()}"
+    produced = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(backfill_slice, settings, extractor_type, f"{key_prefix}:{n}", slice_since, slice_until)
+            for n, (slice_since, slice_until) in enumerate(split_range(since, until, slices))
+        ]
+        for future in as_completed(futures):
+            produced += future.result()
+
+    logger.critical("Backfill `%s` finished, produced `%s` rows.", key_prefix, produced)
@@ -0,0 +1,171 @@
+import math
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from contextlib import closing
+from typing import Type
+
+from etl.etl import movie_etl
+from etl.extractors.base_filmwork_extractor import BaseFilmworkExtractor
+from helpers.exceptions import LeaseLostError
+from helpers.lease import Lease
+from helpers.logger import LoggerFactory
+from storage_clients.redis_client import RedisClient
+
+logger = LoggerFactory().get_logger()
+
+
+class Unit:
+    """Pipe, or a partition of a pipe, leased as a whole."""
+
+    def __init__(self, name: str, state_key: str, extractor_type: Type[BaseFilmworkExtractor], partition, lease: Lease):
+        self.name = name
+        self.state_key = state_key
+        self.extractor_type = extractor_type
+        self.partition = partition
+        self.lease = lease
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    @property
+    def is_held(self) -> bool:
+        return self.lease.token is not None
+
+    @property
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+
+class LeaseCoordinator:
+    """
+    Share pipes, or N partitions of a pipe, between ETL instances by Redis leases.
+    Instance runs pipes it holds leases of in threads and heartbeats the leases,
+    every instance takes its fair share of pipes, leases of a dead instance expire and are taken over.
+    """
+    INSTANCES_KEY = 'lease:instances'
+
+    def __init__(
+        self,
+        settings,
+        pipelines: dict[str, Type[BaseFilmworkExtractor]],
+        workers: dict[str, int],
+        ttl: float = 30.0,
+        heartbeat: float = 10.0,
+        limiter: threading.Semaphore | None = None,
+    ):
+        if settings.reverse_index == 'memory':
+            # links merged by a pipe of one instance would be missed by caches of others
+            logger.error("Memory reverse index can not be shared between ETL instances, disabled. Use `redis`.")
+            settings = settings.copy(update={'reverse_index': None})
+
+        self.settings = settings
+        self.pipelines = pipelines
+        self.workers = workers
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.limiter = limiter
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stop_event = threading.Event()
+        self.units: list[Unit] = []
+
+    def _build_units(self, redis_conn: RedisClient) -> None:
+        for state_key, extractor_type in self.pipelines.items():
+            count = self.workers.get(state_key, 1)
+            for index in range(count):
+                partition = (index, count) if count > 1 else None
+                name = f"{state_key}:{index}of{count}" if partition else state_key
+                lease = Lease(redis_conn, name, self.owner, self.ttl)
+                self.units.append(Unit(name, state_key, extractor_type, partition, lease))
+
+    def _share(self, redis_conn: RedisClient) -> int:
+        """Register instance as alive, return amount of units it should hold."""
+        now = time.time()
+        *_, instances = redis_conn.execute_pipeline([
+            ('zadd', self.INSTANCES_KEY, {self.owner: now + self.ttl}),
+            ('zremrangebyscore', self.INSTANCES_KEY, '-inf', now),
+            ('zcard', self.INSTANCES_KEY),
+        ])
+        return math.ceil(len(self.units) / max(instances, 1))
+
+    def _run_unit(self, unit: Unit) -> None:
+        try:
+            movie_etl(
+                self.settings,
+                unit.extractor_type,
+                unit.state_key,
+                limiter=self.limiter,
+                partition=unit.partition,
+                stop_event=unit.stop_event,
+                lease=unit.lease,
+            )
+        except LeaseLostError as e:
+            logger.error("Pipe `%s` stopped: `%s`", unit.name, str(e))
+        except Exception as e:
+            logger.critical("Pipe `%s` crashed with `%r`", unit.name, e)
+
+    def _start(self, unit: Unit) -> None:
+        unit.stop_event = threading.Event()
+        unit.thread = threading.Thread(target=self._run_unit, args=(unit,), name=unit.name, daemon=True)
+        unit.thread.start()
+        logger.warning("Lease `%s` acquired with token `%s`, pipe started.", unit.name, unit.lease.token)
+
+    def _tick(self, redis_conn: RedisClient) -> None:
+        share = self._share(redis_conn)
+
+        for unit in self.units:
+            if not unit.is_held:
+                continue
+
+            if not unit.is_running:
+                # pipe is stopped or crashed, lease is free for any instance
+                unit.lease.release()
+                logger.warning("Lease `%s` released.", unit.name)
+            elif not unit.lease.renew():
+                # expired while instance was stalled, someone else may run the pipe already
+                logger.error("Lease `%s` is lost, stopping pipe.", unit.name)
+                unit.stop_event.set()
+
+        # stopping pipes keep their leases until their last checkpoint is saved
+        active = [unit for unit in self.units if unit.is_held and not unit.stop_event.is_set()]
+        for unit in active[share:]:
+            logger.warning("Handing lease `%s` over, instance holds more than its share `%s`.", unit.name, share)
+            unit.stop_event.set()
+
+        for unit in self.units:
+            if len(active) >= share:
+                break
+
+            if not unit.is_held and not unit.is_running and unit.lease.acquire():
+                self._start(unit)
+                active.append(unit)
+
+    def _shutdown(self, redis_conn: RedisClient) -> None:
+        for unit in self.units:
+            unit.stop_event.set()
+
+        for unit in self.units:
+            if unit.thread:
+                unit.thread.join()
+            unit.lease.release()
+
+        redis_conn.execute_pipeline([('zrem', self.INSTANCES_KEY, self.owner)])
+
+    def run(self) -> None:
+        """Coordinate pipes until SIGTERM / SIGINT, must be called from the main thread."""
+        signal.signal(signal.SIGTERM, lambda *_: self.stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop_event.set())
+
+        with closing(RedisClient(self.settings.redis_dsn)) as redis_conn:
+            self._build_units(redis_conn)
+            logger.critical("ETL instance `%s` joined, `%s` pipes to share.", self.owner, len(self.units))
+
+            self._tick(redis_conn)
+            while not self.stop_event.wait(self.heartbeat):
+                self._tick(redis_conn)
+
+            logger.critical("ETL instance `%s` is shutting down...", self.owner)
+            self._shutdown(redis_conn)
+            logger.critical("ETL instance `%s` stopped.", self.owner)
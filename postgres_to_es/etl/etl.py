@@ -1,49 +1,192 @@
 import datetime
-import time
-from contextlib import closing
-from typing import Type
+import threading
+from contextlib import ExitStack, closing, contextmanager
+from typing import Callable, Iterator, Type
 
 from psycopg2.extras import DictCursor
 
 from etl.extractors.base_filmwork_extractor import BaseFilmworkExtractor
+from etl.freshness import FreshnessTracker
 from etl.loders.filmwork_loader import FilmworkLoader
+from etl.loders.sinks import BaseSink, make_sink
+from etl.lanes import LaneScheduler
+from etl.profiling import Profiler
+from etl.replicas import ReplicaRouter
+from etl.scheduler import AdaptiveScheduler
+from etl.transformers.document_transformers import (
+    BaseDocumentTransformer,
+    GenreDocumentTransformer,
+    MovieDocumentTransformer,
+    PersonDocumentTransformer,
+)
 from etl.transformers.filmwork_transformer import FilmworkTransformer
-from helpers.state import State, RedisStorage
-from storage_clients.elasticsearch_client import ElasticsearchClient
+from helpers.reverse_index import BaseReverseIndex, MemoryReverseIndex, RedisReverseIndex
+from helpers.lease import Lease
+from helpers.state import FencedRedisStorage, State, RedisStorage
 from storage_clients.postgres_client import PostgresClient
 from storage_clients.redis_client import RedisClient
 
 
-def movie_etl(settings, extractor_type: Type[BaseFilmworkExtractor], state_key: str, timeout: int = 2.5):
-    """Factory of etl pipes"""
+def index_targets(settings) -> list[BaseDocumentTransformer]:
+    """Target indexes fed by one extraction pass, optional ones are enabled by their index name."""
+    targets = [MovieDocumentTransformer(settings.elk_index)]
+
+    if settings.elk_persons_index:
+        targets.append(PersonDocumentTransformer(settings.elk_persons_index))
+
+    if settings.elk_genres_index:
+        targets.append(GenreDocumentTransformer(settings.elk_genres_index))
+
+    return targets
+
+
+def make_reverse_index(settings, redis_conn: RedisClient) -> BaseReverseIndex | None:
+    """Build reverse index configured by settings, memory one is shared by pipes of a process."""
+    if settings.reverse_index == 'redis':
+        return RedisReverseIndex(redis_conn, settings.reverse_index_ttl)
+
+    if settings.reverse_index == 'memory':
+        return MemoryReverseIndex(settings.reverse_index_max_entries)
+
+    return None
+
+
+def make_lanes(settings) -> LaneScheduler | None:
+    """Priority lanes shared by pipes of a process, disabled by zero capacity."""
+    if settings.lane_capacity:
+        return LaneScheduler(settings.lane_capacity, settings.lane_max_wait)
+
+    return None
 
-    with closing(PostgresClient(settings.pg_dsn, cursor_factory=DictCursor)) as pg_conn, \
-            closing(ElasticsearchClient(settings.elk_dsn)) as elk_conn, \
+
+@contextmanager
+def etl_pipeline(
+    settings,
+    extractor_type: Type[BaseFilmworkExtractor],
+    state_key: str,
+    since: datetime.datetime = datetime.datetime.min,
+    until: datetime.datetime | None = None,
+    partition: tuple[int, int] | None = None,
+    stop_event: threading.Event | None = None,
+    lease: Lease | None = None,
+) -> Iterator[BaseFilmworkExtractor]:
+    """
+    Build etl pipe with its own connections, pipe starts from `since` if there is no saved state.
+    Partitioned pipe has its own state key, new one starts from state of the whole pipe.
+    State of a leased pipe is saved only while its `lease` is held.
+    """
+
+    pg_options = {'options': '-c plan_cache_mode=force_generic_plan'} if settings.pg_force_generic_plan else {}
+    pipe_key = f"{state_key}:{partition[0]}of{partition[1]}" if partition else state_key
+
+    with ExitStack() as stack, \
+            closing(PostgresClient(settings.pg_dsn, cursor_factory=DictCursor, **pg_options)) as pg_conn, \
+            closing(make_sink(settings, pipe_key)) as sink, \
             closing(RedisClient(settings.redis_dsn)) as redis_conn:
         pg_conn: PostgresClient
-        elk_conn: ElasticsearchClient
+        sink: BaseSink
         redis_conn: RedisClient
 
-        state = State(RedisStorage(redis_conn), state_key)
+        router = None
+        if settings.pg_replica_dsns:
+            router = stack.enter_context(closing(ReplicaRouter(
+                pg_conn,
+                settings.pg_replica_dsns,
+                selection=settings.pg_replica_selection,
+                max_lag=settings.pg_replica_max_lag,
+                connect_timeout=settings.pg_replica_connect_timeout,
+                cursor_factory=DictCursor,
+                **pg_options,
+            )))
+
+        storage = FencedRedisStorage(redis_conn, lease) if lease else RedisStorage(redis_conn)
+        state = State(storage, state_key)
+
+        if partition:
+            whole_state = state
+            state = State(storage, pipe_key)
+            if not state.exists() and whole_state.exists():
+                since = whole_state.get().updated_at
 
         if not state.exists():
-            state.set(str(datetime.datetime.min))
+            state.set(str(since))
+
+        freshness = None
+        if settings.freshness_tracing:
+            freshness = FreshnessTracker(
+                state.key,
+                sink,
+                sample_rate=settings.freshness_sample_rate,
+                slo=settings.freshness_slo,
+                slo_percentile=settings.freshness_slo_percentile,
+                window=settings.freshness_window,
+                report_interval=settings.freshness_report_interval,
+                visibility_timeout=settings.freshness_visibility_timeout,
+            )
 
+        targets = index_targets(settings)
+        reverse_index = make_reverse_index(settings, redis_conn)
         loader = FilmworkLoader(
-            elk_conn=elk_conn,
+            sink=sink,
             state=state,
-            elk_index=settings.elk_index,
-            load_chunk=settings.load_chunk,
+            targets=targets,
+            freshness=freshness,
         )
         transformer = FilmworkTransformer(
             load_pipe=loader.load,
         )
-        extractor = extractor_type(
+        yield extractor_type(
             pg_conn=pg_conn,
             state=state,
             extract_chunk=settings.extract_chunk,
             transform_pipe=transformer.transform,
+            finish_pipe=loader.finish,
+            rename_pipe=loader.rename if settings.rename_fanout else None,
+            stream=settings.stream_mode,
+            max_inflight_docs=settings.max_inflight_docs,
+            max_inflight_bytes=settings.max_inflight_bytes,
+            until=until,
+            passthrough=settings.passthrough,
+            # side indexes and reverse index read nested objects of every document
+            passthrough_objects=len(targets) > 1 or reverse_index is not None,
+            partition=partition,
+            stop_event=stop_event,
+            prepare=settings.pg_prepare,
+            reverse_index=reverse_index,
+            router=router,
+            lanes=make_lanes(settings),
+            small_fanout=settings.lane_small_fanout,
+            freshness=freshness,
+        )
+
+
+def movie_etl(
+    settings,
+    extractor_type: Type[BaseFilmworkExtractor],
+    state_key: str,
+    limiter: threading.Semaphore | None = None,
+    partition: tuple[int, int] | None = None,
+    stop_event: threading.Event | None = None,
+    report: Callable[[dict], None] | None = None,
+    lease: Lease | None = None,
+):
+    """Factory of etl pipes"""
+    with etl_pipeline(
+        settings, extractor_type, state_key, partition=partition, stop_event=stop_event, lease=lease
+    ) as extractor:
+        # partitions of a pipe are profiled separately
+        Profiler().register(extractor.state.key)
+        min_interval, max_interval = settings.poll_intervals.get(
+            state_key, (settings.poll_min_interval, settings.poll_max_interval)
+        )
+        scheduler = AdaptiveScheduler(
+            name=extractor.state.key,
+            min_interval=min_interval,
+            max_interval=max_interval,
+            factor=settings.poll_backoff_factor,
+            limiter=limiter,
+            stop_event=stop_event,
+            report=report,
+            lanes=extractor.lanes,
         )
-        while True:
-            extractor.extract()
-            time.sleep(timeout)
+        scheduler.run(extractor.extract)
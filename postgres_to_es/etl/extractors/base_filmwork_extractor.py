@@ -1,77 +1,332 @@
+import contextlib
 import datetime
+import threading
+import uuid
 from abc import ABC, abstractmethod
-from typing import Callable, Generator
+from typing import Any, Callable, Generator, Iterator
 
+import psycopg2
 from psycopg2.sql import SQL, Identifier
 
+from etl.freshness import FreshnessTracker
+from etl.lanes import LaneScheduler
+from etl.replicas import ReplicaRouter
 from helpers.logger import LoggerFactory
+from helpers.reverse_index import LINK_FIELDS, BaseReverseIndex
 from helpers.state import State
-from models.filmwork import Filmwork
+from helpers.utils import peak_rss_mb
+from models.filmwork import Filmwork, RawFilmwork
 from models.updated_at_id import UpdatedAtId
-from storage_clients.postgres_client import PostgresClient
+from storage_clients.postgres_client import PostgresClient, PostgresCursor
 
 
 logger = LoggerFactory().get_logger()
 
+# merged filmworks selected by `condition`, documents fields are derived in python
+MERGE_QUERY_TEMPLATE = """
+    SELECT
+        fw.id,
+        fw.rating as rating,
+        fw.title,
+        fw.description,
+        fw.type,
+        COALESCE (
+           json_agg(
+               DISTINCT jsonb_build_object(
+                   'id', g.id,
+                   'name', g.name
+               )
+           ) FILTER (WHERE g.id is not null),
+           '[]'
+        ) as genres,
+        COALESCE (
+           json_agg(
+               DISTINCT jsonb_build_object(
+                   'id', p.id,
+                   'name', p.full_name
+               )
+           ) FILTER (WHERE p.id is not null AND pfw.role = 'director'),
+           '[]'
+        ) as directors,
+        COALESCE (
+           json_agg(
+               DISTINCT jsonb_build_object(
+                   'id', p.id,
+                   'name', p.full_name
+               )
+           ) FILTER (WHERE p.id is not null AND pfw.role = 'actor'),
+           '[]'
+        ) as actors,
+        COALESCE (
+           json_agg(
+               DISTINCT jsonb_build_object(
+                   'id', p.id,
+                   'name', p.full_name
+               )
+           ) FILTER (WHERE p.id is not null AND pfw.role = 'writer'),
+           '[]'
+        ) as writers
+    FROM
+        content.film_work fw
+    LEFT JOIN
+        content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN
+        content.person p ON p.id = pfw.person_id
+    LEFT JOIN
+        content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN
+        content.genre g ON g.id = gfw.genre_id
+    WHERE
+       {condition}
+    GROUP BY
+        fw.id
+"""
+
+MERGE_QUERY = MERGE_QUERY_TEMPLATE.format(condition="fw.id = ANY(%s::uuid[])")
+
+# ready to load documents assembled by PGSQL, passed through as raw json text;
+# nested objects are also selected apart, as `{objects_type}`, not to decode whole documents
+PASSTHROUGH_MERGE_QUERY_TEMPLATE = """
+    SELECT
+        m.id,
+        m.genres::{objects_type} AS genres,
+        m.directors::{objects_type} AS directors,
+        m.actors::{objects_type} AS actors,
+        m.writers::{objects_type} AS writers,
+        json_build_object(
+            'id', m.id,
+            'imdb_rating', NULLIF(m.rating::float, 0),
+            'title', m.title,
+            'description', m.description,
+            'filmwork_type', m.type,
+            'genres_names', ARRAY(SELECT e->>'name' FROM json_array_elements(m.genres) e),
+            'genres', m.genres,
+            'directors_names', ARRAY(SELECT e->>'name' FROM json_array_elements(m.directors) e),
+            'actors_names', ARRAY(SELECT e->>'name' FROM json_array_elements(m.actors) e),
+            'writers_names', ARRAY(SELECT e->>'name' FROM json_array_elements(m.writers) e),
+            'directors', m.directors,
+            'actors', m.actors,
+            'writers', m.writers
+        )::text AS doc
+    FROM ({merge_query}) m
+"""
+
+# text is not decoded by psycopg2, nested objects are decoded only if anything asks for them
+PASSTHROUGH_MERGE_QUERY = PASSTHROUGH_MERGE_QUERY_TEMPLATE.format(objects_type='text', merge_query=MERGE_QUERY)
+
+# nested objects decoded by psycopg2, for side indexes and reverse index that need them for every document
+PASSTHROUGH_OBJECTS_MERGE_QUERY = PASSTHROUGH_MERGE_QUERY_TEMPLATE.format(objects_type='json', merge_query=MERGE_QUERY)
+
 
 class BaseFilmworkExtractor(ABC):
+    # nested document fields holding names of produced objects, empty if names are not denormalized
+    nested_fields: tuple[str, ...] = ()
+    # PGSQL type of ids array parameter of enrich, names and merge queries
+    ids_type = 'uuid[]'
+
     def __init__(
         self,
         pg_conn: PostgresClient,
         state: State,
         extract_chunk: int,
-        transform_pipe: Callable[[], Generator[None, tuple[datetime.datetime, list[Filmwork]] | None, None]]
+        transform_pipe: Callable[[], Generator[None, tuple[datetime.datetime, list[Filmwork]] | None, None]],
+        finish_pipe: Callable[[], None],
+        rename_pipe: Callable[[tuple[str, ...], dict[str, str]], bool] | None = None,
+        stream: bool = False,
+        max_inflight_docs: int = 0,
+        max_inflight_bytes: int = 0,
+        until: datetime.datetime | None = None,
+        passthrough: bool = False,
+        passthrough_objects: bool = False,
+        partition: tuple[int, int] | None = None,
+        stop_event: threading.Event | None = None,
+        prepare: bool = False,
+        reverse_index: BaseReverseIndex | None = None,
+        router: ReplicaRouter | None = None,
+        lanes: LaneScheduler | None = None,
+        small_fanout: int = 1000,
+        freshness: FreshnessTracker | None = None,
     ):
         self.state = state
         self.pg_conn = pg_conn
         self.extract_chunk = extract_chunk
         self.transform_pipe = transform_pipe
+        # saves state of the last loaded batch, once the pipe is closed after a complete loop
+        self.finish_pipe = finish_pipe
+        self.rename_pipe = rename_pipe
+        self.stream = stream
+        # rows fetched from PGSQL at once, documents in flight are bounded by it
+        self.fetch_chunk = min(extract_chunk, max_inflight_docs) if max_inflight_docs else extract_chunk
+        # merged documents in flight are bounded by their size too, 0 means no limit
+        self.max_inflight_bytes = max_inflight_bytes
+        # moving average of merged row size, merge batches are sized by it
+        self._doc_bytes = 0.0
+        # upper bound of produced `updated_at`, for backfill slices
+        self.until = until
+        # documents are assembled by PGSQL and loaded as raw json text
+        self.passthrough = passthrough
+        # nested objects of passthrough documents are used for every document, select them decoded
+        self.passthrough_objects = passthrough_objects
+        # (index, count): produce only objects with id hash in this partition, for parallel workers
+        self.partition = partition
+        # produce loop is stopped on this event, loaded batches are checkpointed on the way out
+        self.stop_event = stop_event
+        # enrich and merge queries are planned once per connection
+        self.prepare = prepare
+        # cache of filmwork ids by linked person / genre, replaces enrich query on hits
+        self.reverse_index = reverse_index
+        # reads of each produce loop are routed to a read replica chosen by it
+        self.router = router
+        # upper bound of `updated_at` read by the last produce loop from a replica, None if read from primary
+        self.horizon: datetime.datetime | None = None
+        # merge and load of each batch wait for a slot of its priority lane
+        self.lanes = lanes
+        # fan-out of a produced batch to more filmworks goes to `bulk` lane
+        self.small_fanout = small_fanout
+        # batches are timestamped on their way from PGSQL to index
+        self.freshness = freshness
         self.produce_table: str | None = None
 
     @abstractmethod
-    def extract(self):
-        """Start pipeline: [produce [-> merge [-> enrich [-> transform -> load]]]], where [] mean inner loops."""
-        self._produce()
+    def extract(self) -> int:
+        """
+        Start pipeline: [produce [-> merge [-> enrich [-> transform -> load]]]], where [] mean inner loops.
+        Return amount of produced rows.
+        """
+        try:
+            return self._produce()
+        except psycopg2.DatabaseError as e:
+            if not self.router or self.pg_conn is self.router.primary:
+                raise
+
+            # replica failed or cancelled a query by recovery conflict mid loop: state holds the last batch loaded
+            # completely, so the loop is rerun from it on another route
+            logger.error("Replica failed in produce loop `%s` with `%s`, re-routing.", self.state.key, str(e).strip())
+            self.router.fail(self.pg_conn)
+            return self._produce()
+
+    def _fetch(
+        self, cur: PostgresCursor, query: SQL | str, params: list, chunk: int, prepared: str | None = None
+    ) -> Iterator[list[Any]]:
+        """
+        Execute query and yield results by chunks.
+        In streaming mode rows are fetched by server side cursor, not to hold the whole result in memory.
+        Otherwise query is executed as `prepared` statement if prepared statements are enabled.
+        """
+        if not self.stream:
+            if self.prepare and prepared:
+                cur.execute_prepared(prepared, query, params, types=[self.ids_type])
+            else:
+                cur.execute(query, params)
+            while results := cur.fetchmany(chunk):
+                yield results
+
+            return
+
+        # named cursor can be executed only once, name is kept short: PGSQL truncates identifiers to 63 bytes
+        with self.pg_conn.cursor(f"etl_{uuid.uuid4().hex}") as named_cur:
+            named_cur.execute(query, params)
+            while results := named_cur.fetchmany(chunk):
+                yield results
+
+    def _slot(self, lane: str) -> contextlib.AbstractContextManager:
+        return self.lanes.slot(lane) if self.lanes else contextlib.nullcontext()
+
+    def _fanout_lane(self, fanout: int) -> str:
+        """Lane of a batch by amount of filmworks its produced batch fanned out to so far."""
+        return 'small' if fanout <= self.small_fanout else 'bulk'
 
     @abstractmethod
-    def _produce(self):
-        """Method to monitor data update in PGSQL. Send data to enricher."""
+    def _produce(self) -> int:
+        """Method to monitor data update in PGSQL. Send data to enricher. Return amount of produced rows."""
         started = False
+        produced = 0
+
+        self.horizon = None
+        if self.router:
+            # rows replica has not caught up with are left for later loops, so state never skips them
+            self.pg_conn, self.horizon = self.router.route()
 
         with self.pg_conn.cursor() as cur:
-            cur.execute(
+            conditions, params = [SQL("updated_at > %s")], [self.state.get().updated_at]
+            for bound in (self.until, self.horizon):
+                if bound:
+                    conditions.append(SQL("updated_at <= %s"))
+                    params.append(bound)
+            if self.partition:
+                conditions.append(SQL("abs(hashtext(id::text) %% %s) = %s"))
+                params.extend([self.partition[1], self.partition[0]])
+
+            for results in self._fetch(
+                cur,
                 SQL("""
                     SELECT
                         id, updated_at
                     FROM
                         content.{produce_table}
                     WHERE
-                        updated_at > %s
+                        {conditions}
                     ORDER BY
                         updated_at;
-                """).format(produce_table=Identifier(self.produce_table)),
-                [self.state.get().updated_at],
-            )
-            while results := cur.fetchmany(500):
+                """).format(produce_table=Identifier(self.produce_table), conditions=SQL(" AND ").join(conditions)),
+                params,
+                500,
+            ):
+                if self.stop_event and self.stop_event.is_set():
+                    logger.warning("Produce loop stopped: `%s`.", self.state.key)
+                    break
+
                 if not started:
                     # not to generate extra cursors
-                    pipe = self._enrich()
+                    pipe = self._rename() if self.rename_pipe and self.nested_fields else self._enrich()
                     pipe.send(None)
                     started = True
 
                 data = [UpdatedAtId(**result) for result in results]
                 last_updated = data[-1].updated_at
+                produced += len(data)
+                if self.freshness:
+                    self.freshness.produced(last_updated, data[0].updated_at)
                 pipe.send((last_updated, data))
 
+            if started:
+                pipe.close()
+                self.finish_pipe()
+
             logger.info(
-                "Produce loop finished: `%s`. Going to start a new loop.", self.state.key
+                "Produce loop finished: `%s`. Peak RSS: `%.1f` MB. Going to start a new loop.",
+                self.state.key, peak_rss_mb(),
             )
 
+        return produced
+
     @property
     @abstractmethod
     def _enrich_query(self) -> SQL | str:
         raise NotImplementedError
 
+    @property
+    def _links_query(self) -> SQL | str:
+        """Query of filmwork ids by linked object id, to fill reverse index."""
+        raise NotImplementedError
+
+    def _linked_filmworks(self, cur: PostgresCursor, ids: list[str]) -> list[str]:
+        """Look filmworks linked to produced objects up in reverse index, query misses and cache them."""
+        cached = self.reverse_index.get(self.produce_table, ids)
+        misses = [id_ for id_ in ids if id_ not in cached]
+        if misses:
+            fetched = {id_: set() for id_ in misses}
+            for results in self._fetch(
+                cur, self._links_query, [misses], self.fetch_chunk, prepared=f"{self.produce_table}_links"
+            ):
+                fetched.update((result['id'], set(result['films'])) for result in results)
+
+            self.reverse_index.put(self.produce_table, fetched)
+            cached.update(fetched)
+
+        logger.debug("Reverse index hits: `%s` of `%s`.", len(ids) - len(misses), len(ids))
+        return list(set().union(*cached.values()))
+
     @abstractmethod
     def _enrich(self):
         """Method to enrich data. Send data to merger. Receive data from producer"""
@@ -82,25 +337,133 @@ class BaseFilmworkExtractor(ABC):
                 while True:
                     last_updated, rows = (yield)
                     rows: list[UpdatedAtId]
+                    fanout = 0
 
-                    cur.execute(
-                        self._enrich_query,
-                        [tuple([row.id for row in rows])],  # psycopg2 is awesome ;<)
-                    )
+                    if self.reverse_index and self.produce_table in LINK_FIELDS:
+                        films = self._linked_filmworks(cur, [row.id for row in rows])
+                        for i in range(0, len(films), self.fetch_chunk):
+                            if not started:
+                                pipe = self._merge()
+                                pipe.send(None)
+                                started = True
 
-                    while results := cur.fetchmany(self.extract_chunk):
+                            chunk = films[i:i + self.fetch_chunk]
+                            fanout += len(chunk)
+                            with self._slot(self._fanout_lane(fanout)):
+                                # merge needs ids only, checkpoint is taken from producer
+                                pipe.send((last_updated, [
+                                    UpdatedAtId(id=id_, updated_at=last_updated) for id_ in chunk
+                                ]))
+                        continue
+
+                    for results in self._fetch(
+                        cur,
+                        self._enrich_query,
+                        [[row.id for row in rows]],
+                        self.fetch_chunk,
+                        prepared=f"{self.produce_table}_enrich",
+                    ):
                         if not started:
                             # not to generate extra cursors
                             pipe = self._merge()
                             pipe.send(None)
                             started = True
 
-                        pipe.send((last_updated, [UpdatedAtId(**result) for result in results]))
+                        fanout += len(results)
+                        with self._slot(self._fanout_lane(fanout)):
+                            pipe.send((last_updated, [UpdatedAtId(**result) for result in results]))
             except GeneratorExit:
                 logger.debug(
                     "Enrich loop finished."
                 )
 
+    @property
+    def _names_query(self) -> SQL | str:
+        raise NotImplementedError
+
+    def _rename(self):
+        """
+        Fan-out mode: send names of produced objects to renamer, skipping enrich and merge.
+        Batches renamer failed to apply are sent to enricher for a full rebuild. Receive data from producer.
+        """
+        fallback = None
+
+        with self.pg_conn.cursor() as cur:
+            try:
+                while True:
+                    last_updated, rows = (yield)
+                    rows: list[UpdatedAtId]
+
+                    names = {}
+                    for results in self._fetch(
+                        cur,
+                        self._names_query,
+                        [[row.id for row in rows]],
+                        self.fetch_chunk,
+                        prepared=f"{self.produce_table}_names",
+                    ):
+                        names.update((result['id'], result['name']) for result in results)
+
+                    with self._slot('bulk'):
+                        # one update by query may touch the whole index
+                        renamed = self.rename_pipe(self.nested_fields, names)
+
+                    if renamed:
+                        if fallback:
+                            # flush state of rebuilt batches first, not to move it backwards later
+                            fallback.close()
+                            self.finish_pipe()
+                            fallback = None
+
+                        self.state.set(str(last_updated))
+                        if self.freshness:
+                            self.freshness.finished(last_updated)
+                        continue
+
+                    logger.warning("Rename failed for: `%s`, going to rebuild documents.", self.state.key)
+                    if not fallback:
+                        fallback = self._enrich()
+                        fallback.send(None)
+
+                    fallback.send((last_updated, rows))
+            except GeneratorExit:
+                if fallback:
+                    fallback.close()
+
+                logger.debug(
+                    "Rename loop finished."
+                )
+
+    @property
+    def _merge_query(self) -> SQL | str:
+        if not self.passthrough:
+            return MERGE_QUERY
+
+        return PASSTHROUGH_OBJECTS_MERGE_QUERY if self.passthrough_objects else PASSTHROUGH_MERGE_QUERY
+
+    def _observe_links(self, docs: list[Filmwork] | list[RawFilmwork]) -> None:
+        """Add links of merged filmworks to reverse index entries."""
+        for kind, fields in LINK_FIELDS.items():
+            links = {}
+            for doc in docs:
+                for field in fields:
+                    for obj in doc.objects(field):
+                        links.setdefault(str(obj['id']), set()).add(str(doc.id))
+
+            self.reverse_index.add_links(kind, links)
+
+    def _merge_chunk(self) -> int:
+        """Filmworks merged at once: `fetch_chunk`, less if their observed size exceeds in flight bytes budget."""
+        if not self.max_inflight_bytes or not self._doc_bytes:
+            return self.fetch_chunk
+
+        return max(1, min(self.fetch_chunk, int(self.max_inflight_bytes // self._doc_bytes)))
+
+    def _observe_size(self, results: list[Any]) -> None:
+        """Update average merged row size by text length of its columns, a cheap estimate of document size."""
+        size = sum(len(str(value)) for result in results for value in result.values()) / len(results)
+        self._doc_bytes = size if not self._doc_bytes else 0.8 * self._doc_bytes + 0.2 * size
+
     @abstractmethod
     def _merge(self):
         """Method to merge data. Send data to transformer. Receive data from enricher."""
@@ -112,69 +475,31 @@ class BaseFilmworkExtractor(ABC):
                 while True:
                     last_updated, rows = (yield)
                     rows: list[UpdatedAtId]
-                    cur.execute(
-                        """
-                            SELECT
-                                fw.id,
-                                fw.rating as rating,
-                                fw.title,
-                                fw.description,
-                                fw.type,
-                                COALESCE (
-                                   json_agg(
-                                       DISTINCT jsonb_build_object(
-                                           'id', g.id,
-                                           'name', g.name
-                                       )
-                                   ) FILTER (WHERE g.id is not null),
-                                   '[]'
-                                ) as genres,
-                                COALESCE (
-                                   json_agg(
-                                       DISTINCT jsonb_build_object(
-                                           'id', p.id,
-                                           'name', p.full_name
-                                       )
-                                   ) FILTER (WHERE p.id is not null AND pfw.role = 'director'),
-                                   '[]'
-                                ) as directors,
-                                COALESCE (
-                                   json_agg(
-                                       DISTINCT jsonb_build_object(
-                                           'id', p.id,
-                                           'name', p.full_name
-                                       )
-                                   ) FILTER (WHERE p.id is not null AND pfw.role = 'actor'),
-                                   '[]'
-                                ) as actors,
-                                COALESCE (
-                                   json_agg(
-                                       DISTINCT jsonb_build_object(
-                                           'id', p.id,
-                                           'name', p.full_name
-                                       )
-                                   ) FILTER (WHERE p.id is not null AND pfw.role = 'writer'),
-                                   '[]'
-                                ) as writers
-                            FROM
-                                content.film_work fw
-                            LEFT JOIN
-                                content.person_film_work pfw ON pfw.film_work_id = fw.id
-                            LEFT JOIN
-                                content.person p ON p.id = pfw.person_id
-                            LEFT JOIN
-                                content.genre_film_work gfw ON gfw.film_work_id = fw.id
-                            LEFT JOIN
-                                content.genre g ON g.id = gfw.genre_id
-                            WHERE
-                               fw.id IN %s
-                            GROUP BY
-                                fw.id;
-                        """,
-                        [tuple([row.id for row in rows])],  # psycopg2 is awesome ;<)
-                    )
-                    while results := cur.fetchmany(self.extract_chunk):
-                        pipe.send((last_updated, [Filmwork(**result) for result in results]))
+                    ids = [row.id for row in rows]
+                    start = 0
+                    while start < len(ids):
+                        chunk = self._merge_chunk()
+                        for results in self._fetch(
+                            cur,
+                            self._merge_query,
+                            [ids[start:start + chunk]],
+                            chunk,
+                            prepared="merge_passthrough" if self.passthrough else "merge",
+                        ):
+                            if self.max_inflight_bytes:
+                                self._observe_size(results)
+                            if self.passthrough:
+                                # no need to validate, document is built by PGSQL
+                                docs = [RawFilmwork.construct(**result) for result in results]
+                            else:
+                                docs = [Filmwork(**result) for result in results]
+
+                            if self.reverse_index:
+                                self._observe_links(docs)
+                            if self.freshness:
+                                self.freshness.merged(last_updated)
+                            pipe.send((last_updated, docs))
+                        start += chunk
             except GeneratorExit:
                 logger.debug(
                     "Merge loop finished."
@@ -7,10 +7,10 @@ class FilmworkExtractor(BaseFilmworkExtractor):
         super().__init__(*args, **kwargs)
         self.produce_table = 'film_work'
 
-    def extract(self):
+    def extract(self) -> int:
         return super().extract()
 
-    def _produce(self):
+    def _produce(self) -> int:
         return super()._produce()
 
     @property
@@ -25,7 +25,8 @@ class FilmworkExtractor(BaseFilmworkExtractor):
         try:
             while True:
                 last_updated, rows = (yield)
-                pipe.send((last_updated, rows))
+                with self._slot('direct'):
+                    pipe.send((last_updated, rows))
 
         except GeneratorExit:
             pass
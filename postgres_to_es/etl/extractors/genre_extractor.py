@@ -2,15 +2,16 @@ from etl.extractors.base_filmwork_extractor import BaseFilmworkExtractor
 
 
 class GenreExtractor(BaseFilmworkExtractor):
+    nested_fields = ('genres',)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.produce_table = 'genre'
 
-    def extract(self):
+    def extract(self) -> int:
         return super().extract()
 
-    def _produce(self):
+    def _produce(self) -> int:
         return super()._produce()
 
     @property
@@ -23,11 +24,35 @@ class GenreExtractor(BaseFilmworkExtractor):
             LEFT JOIN
                 content.genre_film_work gfw ON gfw.film_work_id = fw.id
             WHERE
-                gfw.genre_id IN %s
+                gfw.genre_id = ANY(%s::uuid[])
             ORDER BY
                 fw.updated_at;
         """
 
+    @property
+    def _names_query(self) -> str:
+        return """
+            SELECT
+                g.id, g.name
+            FROM
+                content.genre g
+            WHERE
+                g.id = ANY(%s::uuid[]);
+        """
+
+    @property
+    def _links_query(self) -> str:
+        return """
+            SELECT
+                gfw.genre_id AS id, array_agg(DISTINCT gfw.film_work_id::text) AS films
+            FROM
+                content.genre_film_work gfw
+            WHERE
+                gfw.genre_id = ANY(%s::uuid[])
+            GROUP BY
+                gfw.genre_id;
+        """
+
     def _enrich(self):
         return super()._enrich()
 
@@ -2,15 +2,16 @@ from etl.extractors.base_filmwork_extractor import BaseFilmworkExtractor
 
 
 class PersonExtractor(BaseFilmworkExtractor):
+    nested_fields = ('actors', 'directors', 'writers')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.produce_table = 'person'
 
-    def extract(self):
+    def extract(self) -> int:
         return super().extract()
 
-    def _produce(self):
+    def _produce(self) -> int:
         return super()._produce()
 
     @property
@@ -23,11 +24,35 @@ class PersonExtractor(BaseFilmworkExtractor):
             LEFT JOIN
                 content.person_film_work pfw ON pfw.film_work_id = fw.id
             WHERE
-                pfw.person_id IN %s
+                pfw.person_id = ANY(%s::uuid[])
             ORDER BY
                 fw.updated_at;
         """
 
+    @property
+    def _names_query(self) -> str:
+        return """
+            SELECT
+                p.id, p.full_name AS name
+            FROM
+                content.person p
+            WHERE
+                p.id = ANY(%s::uuid[]);
+        """
+
+    @property
+    def _links_query(self) -> str:
+        return """
+            SELECT
+                pfw.person_id AS id, array_agg(DISTINCT pfw.film_work_id::text) AS films
+            FROM
+                content.person_film_work pfw
+            WHERE
+                pfw.person_id = ANY(%s::uuid[])
+            GROUP BY
+                pfw.person_id;
+        """
+
     def _enrich(self):
         return super()._enrich()
 
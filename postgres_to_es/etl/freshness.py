@@ -0,0 +1,208 @@
+import collections
+import datetime
+import queue
+import random
+import statistics
+import threading
+import time
+
+from etl.loders.sinks import BaseSink
+from helpers.logger import LoggerFactory
+
+logger = LoggerFactory().get_logger()
+
+
+class Batch:
+    """Timestamps of a produced batch on its way to the index."""
+
+    def __init__(self, source_updated_at: datetime.datetime):
+        # oldest change in the batch, documents are at least this stale
+        self.source_updated_at = source_updated_at.timestamp()
+        self.produced_at = time.time()
+        self.merged_at: float | None = None
+        self.acked_at: float | None = None
+
+
+class Sample:
+    """Document sampled for get after write check."""
+
+    def __init__(self, batch: Batch, index: str, id_: str):
+        self.batch = batch
+        self.index = index
+        self.id_ = id_
+        # batch is acknowledged by chunks, every document has its own acknowledgement time
+        self.acked_at = time.time()
+        # sequence number of the acknowledged write, searchable document reaches it
+        self.seq_no: int | None = None
+        self.deadline = 0.0
+
+
+# sampled documents waiting for get after write check, more samples are dropped
+MAX_PENDING_CHECKS = 1000
+
+# seconds between polls of pending samples
+CHECK_INTERVAL = 0.05
+
+
+class FreshnessTracker:
+    """
+    Trace freshness of documents of a pipe: time from PGSQL `updated_at` of a change to its indexed document.
+    Batches are keyed by their produce checkpoint and timestamped on produce, first merge and bulk acknowledgement.
+    Sampled documents are read back after write until a search would see them, that is after index refresh.
+    Percentiles of freshness over the last `window` batches are logged every `report_interval` seconds,
+    their `slo_percentile` exceeding `slo` seconds is logged as an alert.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sink: BaseSink,
+        sample_rate: float = 0.01,
+        slo: float = 60.0,
+        slo_percentile: int = 95,
+        window: int = 1000,
+        report_interval: float = 60.0,
+        visibility_timeout: float = 60.0,
+    ):
+        self.name = name
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.slo = slo
+        self.slo_percentile = slo_percentile
+        self.report_interval = report_interval
+        self.visibility_timeout = visibility_timeout
+        self._batches: dict[datetime.datetime, Batch] = {}
+        self._lock = threading.Lock()
+        self._samples = {
+            stage: collections.deque(maxlen=window) for stage in ('merge', 'ack', 'visible', 'acked', 'searchable')
+        }
+        self._reported_at = time.monotonic()
+        self._checks: queue.Queue = queue.Queue()
+        self._pending: list[Sample] = []
+        self._checker: threading.Thread | None = None
+
+    def produced(self, key: datetime.datetime, source_updated_at: datetime.datetime) -> None:
+        self._batches.setdefault(key, Batch(source_updated_at))
+
+    def merged(self, key: datetime.datetime) -> None:
+        if (batch := self._batches.get(key)) and batch.merged_at is None:
+            batch.merged_at = time.time()
+
+    def loaded(self, key: datetime.datetime, index: str, ids: list[str]) -> None:
+        """Bulk of documents is acknowledged, sample some of them for get after write check."""
+        if not (batch := self._batches.get(key)):
+            return
+
+        batch.acked_at = time.time()
+        for id_ in ids:
+            if random.random() < self.sample_rate and self._checks.qsize() + len(self._pending) < MAX_PENDING_CHECKS:
+                self._check(Sample(batch, index, id_))
+
+    def finished(self, key: datetime.datetime) -> None:
+        """Batch is checkpointed, batches produced before it are done too."""
+        now = time.time()
+        with self._lock:
+            for done in [done for done in self._batches if done <= key]:
+                batch = self._batches.pop(done)
+                if batch.merged_at:
+                    self._samples['merge'].append(batch.merged_at - batch.produced_at)
+                if batch.merged_at and batch.acked_at:
+                    self._samples['ack'].append(batch.acked_at - batch.merged_at)
+                self._samples['acked'].append((batch.acked_at or now) - batch.source_updated_at)
+
+        self.report()
+
+    def _check(self, sample: Sample) -> None:
+        if not self._checker:
+            self._checker = threading.Thread(target=self._run_checks, name=f"freshness-{self.name}", daemon=True)
+            self._checker.start()
+
+        self._checks.put(sample)
+
+    def _take(self, sample: Sample) -> None:
+        """Start checking a sample: remember sequence number of its acknowledged write."""
+        # realtime get sees acknowledged writes before refresh
+        if (seq_no := self.sink.seq_no(sample.index, sample.id_)) is None:
+            # sink can not tell when documents become searchable
+            return
+
+        sample.seq_no = seq_no
+        sample.deadline = time.monotonic() + self.visibility_timeout
+        self._pending.append(sample)
+
+    def _run_checks(self) -> None:
+        """
+        Poll all sampled documents together each tick, until the written version of each is seen by non realtime get.
+        Visibility time of a sample is taken on the tick it is first seen, not when the checker gets to it.
+        """
+        while True:
+            try:
+                # nothing to poll: wait for samples without spinning
+                samples = [] if self._pending else [self._checks.get()]
+                while True:
+                    samples.append(self._checks.get_nowait())
+            except queue.Empty:
+                pass
+
+            for sample in samples:
+                try:
+                    self._take(sample)
+                except Exception as e:
+                    logger.error("Get after write check of `%s` failed with `%s`", sample.id_, str(e))
+
+            pending = []
+            for sample in self._pending:
+                try:
+                    seen = self.sink.seq_no(sample.index, sample.id_, realtime=False)
+                except Exception as e:
+                    logger.error("Get after write check of `%s` failed with `%s`", sample.id_, str(e))
+                    continue
+
+                if seen is not None and seen >= sample.seq_no:
+                    visible_at = time.time()
+                    with self._lock:
+                        self._samples['visible'].append(visible_at - sample.acked_at)
+                        self._samples['searchable'].append(visible_at - sample.batch.source_updated_at)
+                elif time.monotonic() > sample.deadline:
+                    logger.warning(
+                        "Document `%s` of `%s` is not searchable after `%s`s.",
+                        sample.id_, sample.index, self.visibility_timeout,
+                    )
+                else:
+                    pending.append(sample)
+
+            self._pending = pending
+            if pending:
+                time.sleep(CHECK_INTERVAL)
+
+    @staticmethod
+    def percentile(samples, percentile: int) -> float:
+        if len(samples) == 1:
+            return samples[0]
+
+        return statistics.quantiles(samples, n=100, method='inclusive')[percentile - 1]
+
+    def percentiles(self, samples) -> dict[str, float]:
+        return {f"p{cut}": round(self.percentile(samples, cut), 3) for cut in (50, 95, 99)} if samples else {}
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Percentiles of stage latencies and of end to end freshness, in seconds."""
+        with self._lock:
+            return {stage: self.percentiles(samples) for stage, samples in self._samples.items()}
+
+    def report(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self._reported_at < self.report_interval:
+            return
+
+        self._reported_at = time.monotonic()
+        stats = self.stats()
+        logger.info("Freshness of `%s`: `%s`", self.name, stats)
+
+        # searchable documents are the ones users see, acknowledged ones are a lower bound without sampling
+        with self._lock:
+            samples = list(self._samples['searchable'] or self._samples['acked'])
+
+        if samples and (value := self.percentile(samples, self.slo_percentile)) > self.slo:
+            logger.error(
+                "Freshness SLO of `%s` breached: p%s `%.1f`s > `%s`s.", self.name, self.slo_percentile, value, self.slo
+            )
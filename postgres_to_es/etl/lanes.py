@@ -0,0 +1,73 @@
+import collections
+import contextlib
+import threading
+import time
+from typing import Iterator
+
+from helpers.logger import LoggerFactory
+from helpers.utils import SingletonType
+
+logger = LoggerFactory().get_logger()
+
+# lanes by priority: direct filmwork changes, fan-outs of few filmworks, bulk fan-outs
+LANES = ('direct', 'small', 'bulk')
+
+
+class LaneScheduler(metaclass=SingletonType):
+    """
+    Process wide gate of merge and load capacity shared by pipelines running in threads.
+    Every batch takes one of `capacity` slots for its merge, transform and load.
+    Free slot goes to the highest priority lane, unless a lower one waits longer than `max_wait` seconds:
+    then the longest waiting batch is served, so bulk fan-outs slow down but never stop.
+    """
+
+    def __init__(self, capacity: int = 1, max_wait: float = 5.0):
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self._free = capacity
+        self._condition = threading.Condition()
+        self._queues: dict[str, collections.deque] = {lane: collections.deque() for lane in LANES}
+
+    def _head(self) -> tuple[object, float] | None:
+        """Batch to be served next."""
+        heads = [queue[0] for queue in self._queues.values() if queue]
+        if not heads:
+            return None
+
+        oldest = min(heads, key=lambda head: head[1])
+        if time.monotonic() - oldest[1] > self.max_wait:
+            return oldest
+
+        return heads[0]
+
+    @contextlib.contextmanager
+    def slot(self, lane: str) -> Iterator[None]:
+        """Wait for a slot of `lane` and hold it while the batch is processed."""
+        head = (object(), time.monotonic())
+        with self._condition:
+            self._queues[lane].append(head)
+            while not (self._free and self._head() is head):
+                # aging is checked on each wake up, not only when a slot is freed
+                self._condition.wait(self.max_wait)
+
+            self._queues[lane].popleft()
+            self._free -= 1
+            waited = time.monotonic() - head[1]
+            self._condition.notify_all()
+
+        if waited > self.max_wait:
+            logger.warning("Batch of lane `%s` waited `%.1f`s for a slot, lanes: `%s`", lane, waited, self.depths())
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._free += 1
+                self._condition.notify_all()
+
+    def depths(self) -> dict[str, int]:
+        """Batches waiting in each lane and batches being processed."""
+        depths = {lane: len(queue) for lane, queue in self._queues.items()}
+        depths['running'] = self.capacity - self._free
+
+        return depths
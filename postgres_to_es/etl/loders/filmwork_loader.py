@@ -1,75 +1,105 @@
+import datetime
+
+from etl.freshness import FreshnessTracker
+from etl.loders.sinks import BaseSink
+from etl.transformers.document_transformers import BaseDocumentTransformer
 from helpers.logger import LoggerFactory
 from helpers.state import State
 from models.filmwork import Filmwork
-from storage_clients.elasticsearch_client import ElasticsearchClient
 
 logger = LoggerFactory().get_logger()
 
 
 class FilmworkLoader:
+    """Fan-out sink: load each batch to every target index, state is saved once all of them are loaded."""
+
     def __init__(
             self,
-            elk_conn: ElasticsearchClient,
+            sink: BaseSink,
             state: State,
-            elk_index: str,
-            load_chunk: int,
+            targets: list[BaseDocumentTransformer],
+            freshness: FreshnessTracker | None = None,
     ):
-        self.elk_conn = elk_conn
+        self.sink = sink
         self.state = state
-        self.elk_index = elk_index
-        self.load_chunk = load_chunk
+        self.targets = targets
+        self.freshness = freshness
+        self.peak_inflight_docs = 0
+        # last batch of the current load cycle, saved by `finish` only, never on teardown by an exception
+        self.saved_state: datetime.datetime | None = None
+
+    def rename(self, fields: tuple[str, ...], names: dict[str, str]) -> bool:
+        """
+        Update names of nested `fields` objects in place with one update by query task per target index.
+        Return False if some documents were not updated and need a full rebuild.
+        """
+        if not names:
+            return True
+
+        result = True
+        for target in self.targets:
+            if query := target.rename_query(fields, names):
+                response = self.sink.update_by_query(target.index, **query)
+                logger.info(
+                    "Renamed `%s` objects in `%s` documents of `%s` for: `%s`",
+                    len(names), response.get("updated"), target.index, self.state.key,
+                )
+                result = result and not response.get("version_conflicts") and not response.get("failures")
+
+            if actions := target.rename_actions(fields, names):
+                self.sink.bulk(target.index, actions)
+
+        if result:
+            self.sink.checkpoint()
+
+        return result
+
+    def _save(self, saved_state: datetime.datetime) -> None:
+        self.sink.checkpoint()
+        self.state.set(str(saved_state))
+        if self.freshness:
+            self.freshness.finished(saved_state)
 
     def load(self):
         """Method to load data to ELK. Send data to loader. Receive data from transformer."""
 
-        saved_state = None
+        self.saved_state = None
 
         try:
             while True:
                 last_updated, rows = (yield)
                 rows: list[Filmwork]
 
-                if not saved_state:
-                    saved_state = last_updated
-                elif saved_state != last_updated:
+                if not self.saved_state:
+                    self.saved_state = last_updated
+                elif self.saved_state != last_updated:
                     # save index on each cycle of fetchmany in produce
                     logger.warn(
-                        "Produce cycle finished, updating index: `%s` with value: `%s`", self.state.key, saved_state
+                        "Produce cycle finished, updating index: `%s` with value: `%s`",
+                        self.state.key, self.saved_state,
                     )
-                    self.state.set(str(saved_state))
-                    saved_state = last_updated
-
-                data = [{
-                    '_op_type': 'update',
-                    "_id": row.id,
-                    "doc": {
-                        "id": row.id,
-                        "imdb_rating": row.rating,
-                        "title": row.title,
-                        "description": row.description,
-                        "filmwork_type": row.type,
-                        "genres_names": row.genres_names,
-                        "genres": [dict(genre) for genre in row.genres],
-                        "directors_names": row.directors_names,
-                        "actors_names": row.actors_names,
-                        "writers_names": row.writers_names,
-                        "directors": [dict(director) for director in row.directors],
-                        "actors": [dict(actor) for actor in row.actors],
-                        "writers": [dict(writer) for writer in row.writers],
-                    },
-                    "doc_as_upsert": True
-                } for row in rows]
-
-                self.elk_conn.chunked_bulk(
-                    actions=data, chunk_size=self.load_chunk, index=self.elk_index, raise_on_exception=True
-                )
+                    self._save(self.saved_state)
+                    self.saved_state = last_updated
+
+                self.peak_inflight_docs = max(self.peak_inflight_docs, len(rows))
+                for target in self.targets:
+                    self.sink.bulk(target.index, target.actions(rows))
+
+                if self.freshness:
+                    # documents of the first target are the ones keyed by filmwork id
+                    self.freshness.loaded(last_updated, self.targets[0].index, [row.id for row in rows])
 
         except GeneratorExit:
+            # pipe is closed by garbage collection too, when an upstream stage fails in the middle of a batch
             logger.debug(
-                "Load cycle finished: `%s`", self.state.key
+                "Load cycle finished: `%s`. Peak documents in flight: `%s`", self.state.key, self.peak_inflight_docs
             )
-            if saved_state:
-                logger.warn(
-                    "Updating index: `%s` with value: `%s`", self.state.key, saved_state
-                )
-                self.state.set(str(saved_state))
+
+    def finish(self) -> None:
+        """Save state of the last batch, called by producer once every batch of the cycle is sent completely."""
+        if self.saved_state:
+            logger.warn(
+                "Updating index: `%s` with value: `%s`", self.state.key, self.saved_state
+            )
+            self._save(self.saved_state)
+            self.saved_state = None
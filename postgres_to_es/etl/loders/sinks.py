@@ -0,0 +1,229 @@
+import datetime
+import gzip
+import json
+import os
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import IO, Iterable
+
+from helpers.logger import LoggerFactory
+from storage_clients.elasticsearch_client import ElasticsearchClient
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, needed for `zstd` compression only
+    zstandard = None
+
+logger = LoggerFactory().get_logger()
+
+
+class BaseSink(ABC):
+    """Destination of bulk actions built by loader."""
+
+    @abstractmethod
+    def ensure_index(self, index: str, mapping_file: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def bulk(self, index: str, actions: Iterable[dict]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_by_query(self, index: str, **kwargs) -> dict:
+        """Return update by query response, failures in it make loader fall back to full rebuild."""
+        raise NotImplementedError
+
+    def checkpoint(self) -> None:
+        """Make everything written so far durable, called before state is saved."""
+        pass
+
+    def seq_no(self, index: str, id_: str, realtime: bool = True) -> int | None:
+        """
+        Sequence number of the last write of a document, None if it is missing or sink can not tell.
+        Not `realtime` one is the last write visible to search.
+        """
+        return None
+
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError
+
+
+class ElasticsearchSink(BaseSink):
+    # seconds between polls of update by query task
+    TASK_POLL_INTERVAL = 1.0
+
+    def __init__(self, elk_dsn: str, load_chunk: int, max_chunk_bytes: int, rename_timeout: float = 600.0):
+        self.elk_conn = ElasticsearchClient(elk_dsn)
+        self.load_chunk = load_chunk
+        self.max_chunk_bytes = max_chunk_bytes
+        self.rename_timeout = rename_timeout
+
+    def ensure_index(self, index: str, mapping_file: str) -> None:
+        if not self.elk_conn.index_exists(index):
+            logger.warn("ELK index `%s` is missing", index)
+            with open(mapping_file, 'r') as f:
+                data = json.load(f)
+                self.elk_conn.index_create(index, body=data)
+
+            logger.warn("ELK index `%s` created", index)
+
+    def bulk(self, index: str, actions: Iterable[dict]) -> None:
+        self.elk_conn.chunked_bulk(
+            actions=actions, chunk_size=self.load_chunk, index=index,
+            max_chunk_bytes=self.max_chunk_bytes, raise_on_exception=True,
+        )
+
+    def update_by_query(self, index: str, **kwargs) -> dict:
+        """
+        Run update by query as a task and poll it, a rename of a popular object outlives any request timeout.
+        Task running longer than `rename_timeout` is cancelled and reported as failed, so the batch is rebuilt.
+        """
+        task_id = self.elk_conn.update_by_query(
+            index=index, conflicts="proceed", wait_for_completion=False, **kwargs
+        )["task"]
+        deadline = time.monotonic() + self.rename_timeout
+        while not (task := self.elk_conn.get_task(task_id))["completed"]:
+            if time.monotonic() > deadline:
+                self.elk_conn.cancel_task(task_id)
+                logger.error("Update by query task `%s` of `%s` timed out, cancelled.", task_id, index)
+                return {"failures": [f"task `{task_id}` timed out after `{self.rename_timeout}`s"]}
+
+            time.sleep(self.TASK_POLL_INTERVAL)
+
+        if error := task.get("error"):
+            return {"failures": [error]}
+
+        return task["response"]
+
+    def seq_no(self, index: str, id_: str, realtime: bool = True) -> int | None:
+        if doc := self.elk_conn.get(index, id_, realtime=realtime, source=False):
+            return doc['_seq_no']
+
+        return None
+
+    def close(self) -> None:
+        self.elk_conn.close()
+
+
+class FileSink(BaseSink):
+    """
+    Write actions as rotating NDJSON files in ELK `_bulk` format, ready for offline import:
+    `curl -XPOST <elk>/_bulk -H 'Content-Type: application/x-ndjson' --data-binary @<file>`.
+    Files are written by large buffered blocks and fsynced on checkpoints, so they stay consistent with state.
+    """
+    EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        compression: str | None = None,
+        max_file_bytes: int = 1024 ** 3,
+        buffer_bytes: int = 8 * 1024 ** 2,
+    ):
+        if compression not in self.EXTENSIONS:
+            raise ValueError(f"Unknown compression: `{compression}`")
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError("`zstandard` package is required for `zstd` compression")
+
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_file_bytes = max_file_bytes
+        self.buffer_bytes = buffer_bytes
+        self._started = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        self._number = 0
+        self._raw: IO[bytes] | None = None
+        self._stream: IO[bytes] | None = None
+        self._written = 0
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._number += 1
+        path = os.path.join(
+            self.directory,
+            f"{self.prefix}-{self._started}-{self._number:04d}.ndjson{self.EXTENSIONS[self.compression]}",
+        )
+        self._raw = open(path, 'wb', buffering=self.buffer_bytes)
+        if self.compression == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        elif self.compression == 'zstd':
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+        self._written = 0
+        logger.info("Writing bulk file: `%s`", path)
+
+    def _rotate(self) -> None:
+        self.checkpoint()
+        self._close_file()
+        self._open()
+
+    def _close_file(self) -> None:
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+        self._raw = self._stream = None
+
+    def ensure_index(self, index: str, mapping_file: str) -> None:
+        pass
+
+    def bulk(self, index: str, actions: Iterable[dict]) -> None:
+        for action in actions:
+            if not self._stream:
+                self._open()
+            elif self._written >= self.max_file_bytes:
+                # rotate on action boundary only, every file is importable by itself
+                self._rotate()
+
+            action = dict(action)
+            op_type = action.pop('_op_type', 'index')
+            meta = {'_index': index, '_id': action.pop('_id')}
+            line = json.dumps({op_type: meta}) + '\n'
+            if op_type != 'delete':
+                # delete has no source line
+                source = action.pop('_source', action)
+                if not isinstance(source, str):
+                    source = json.dumps(source, ensure_ascii=False)
+                line += source + '\n'
+            line = line.encode()
+
+            self._stream.write(line)
+            self._written += len(line)
+
+    def update_by_query(self, index: str, **kwargs) -> dict:
+        return {"failures": ["update by query can not be expressed in `_bulk` format"]}
+
+    def checkpoint(self) -> None:
+        if not self._stream:
+            return
+
+        if self.compression == 'gzip':
+            self._stream.flush(zlib.Z_SYNC_FLUSH)
+        elif self.compression == 'zstd':
+            self._stream.flush(zstandard.FLUSH_BLOCK)
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+
+    def close(self) -> None:
+        if self._stream:
+            self.checkpoint()
+            self._close_file()
+
+
+def make_sink(settings, prefix: str) -> BaseSink:
+    """Build sink configured by settings, `prefix` tags files of file sink."""
+    if settings.sink == 'file':
+        return FileSink(
+            directory=settings.sink_dir,
+            prefix=prefix,
+            compression=settings.sink_compression or None,
+            max_file_bytes=settings.sink_max_file_bytes,
+            buffer_bytes=settings.sink_buffer_bytes,
+        )
+
+    return ElasticsearchSink(
+        settings.elk_dsn, settings.load_chunk, settings.load_max_chunk_bytes, rename_timeout=settings.rename_timeout
+    )
@@ -0,0 +1,182 @@
+import collections
+import datetime
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+from etl.extractors.base_filmwork_extractor import BaseFilmworkExtractor
+from etl.loders.filmwork_loader import FilmworkLoader
+from etl.transformers.filmwork_transformer import FilmworkTransformer
+from helpers.logger import LoggerFactory
+from helpers.utils import SingletonType
+
+logger = LoggerFactory().get_logger()
+
+STAGES: dict[str, Callable] = {
+    'produce': BaseFilmworkExtractor._produce,
+    'enrich': BaseFilmworkExtractor._enrich,
+    'merge': BaseFilmworkExtractor._merge,
+    'transform': FilmworkTransformer.transform,
+    'load': FilmworkLoader.load,
+}
+
+
+def _code_ranges() -> dict[tuple[str, int], str]:
+    """Map (filename, line) of stage methods to stage names."""
+    ranges = {}
+    for stage, func in STAGES.items():
+        code = func.__code__
+        for _, _, line in code.co_lines():
+            if line:
+                ranges[(code.co_filename, line)] = stage
+
+    return ranges
+
+
+class Profiler(metaclass=SingletonType):
+    """
+    On-demand profiling of running pipelines, switched on by a signal or by local admin endpoint:
+    sampling of a pipeline thread stacks and tracemalloc snapshots diff grouped by pipeline stage.
+    Results are dumped to `profile_dir` in files tagged with a pipeline state key.
+    """
+
+    def __init__(self, profile_dir: str = '/tmp/etl_profiles', seconds: float = 30, interval: float = 0.005):
+        self.profile_dir = profile_dir
+        self.seconds = seconds
+        self.interval = interval
+        self._threads: dict[str, int] = {}
+        self._memory_lock = threading.Lock()
+
+    def register(self, state_key: str) -> None:
+        """Register current thread as the one running `state_key` pipeline."""
+        self._threads[state_key] = threading.get_ident()
+
+    def _path(self, state_key: str, kind: str, ext: str) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        return os.path.join(self.profile_dir, f"{state_key}-{kind}-{timestamp}.{ext}")
+
+    def sample_cpu(self, state_key: str, seconds: float) -> str:
+        """Sample stacks of a pipeline thread, dump them in collapsed (flamegraph) format."""
+        ident = self._threads[state_key]
+        stacks = collections.Counter()
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(ident)
+            stack = []
+            while frame:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+
+            if stack:
+                stacks[';'.join(reversed(stack))] += 1
+
+            time.sleep(self.interval)
+
+        path = self._path(state_key, 'cpu', 'folded')
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        return path
+
+    def trace_memory(self, state_key: str, seconds: float) -> str:
+        """
+        Diff tracemalloc snapshots taken `seconds` apart and group it by innermost pipeline stage.
+        Allocations are traced process wide, stages are shared by pipelines running in parallel.
+        """
+        with self._memory_lock:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(25)
+
+            try:
+                before = tracemalloc.take_snapshot()
+                time.sleep(seconds)
+                after = tracemalloc.take_snapshot()
+            finally:
+                if started:
+                    tracemalloc.stop()
+
+        ranges = _code_ranges()
+        stages = collections.defaultdict(lambda: [0, 0, []])  # stage: [size diff, count diff, top lines]
+        for stat in after.compare_to(before, 'traceback'):
+            frames = ((frame.filename, frame.lineno) for frame in reversed(stat.traceback))
+            stage = next((ranges[key] for key in frames if key in ranges), 'other')
+            stages[stage][0] += stat.size_diff
+            stages[stage][1] += stat.count_diff
+            stages[stage][2].append(stat)
+
+        path = self._path(state_key, 'memory', 'txt')
+        with open(path, 'w') as f:
+            for stage, (size_diff, count_diff, stats) in sorted(stages.items(), key=lambda item: -item[1][0]):
+                f.write(f"== {stage}: {size_diff / 1024:+.1f} KiB, {count_diff:+d} blocks\n")
+                for stat in sorted(stats, key=lambda stat: -stat.size_diff)[:10]:
+                    f.write(f"   {stat.size_diff / 1024:+.1f} KiB {stat.traceback[-1]}\n")
+
+        return path
+
+    def profile(self, state_keys: list[str] | None = None, kind: str = 'cpu', seconds: float | None = None) -> None:
+        """Profile pipelines in background threads, all registered pipelines by default."""
+        run = self.sample_cpu if kind == 'cpu' else self.trace_memory
+
+        def target(state_key: str) -> None:
+            try:
+                logger.warning("Profiling `%s` of `%s` started.", kind, state_key)
+                logger.warning("Profile of `%s` dumped to: `%s`", state_key, run(state_key, seconds or self.seconds))
+            except Exception as e:
+                logger.error("Profiling of `%s` failed with `%s`", state_key, str(e))
+
+        for state_key in state_keys or list(self._threads):
+            if state_key not in self._threads:
+                raise KeyError(f"Pipeline `{state_key}` is not running")
+
+            threading.Thread(target=target, args=(state_key,), name=f"profile-{state_key}", daemon=True).start()
+
+    def install_signal(self, cpu_signal: int = signal.SIGUSR1, memory_signal: int = signal.SIGUSR2) -> None:
+        """Profile all pipelines by a signal sent to the process, must be called from the main thread."""
+        signal.signal(cpu_signal, lambda *_: self.profile(kind='cpu'))
+        signal.signal(memory_signal, lambda *_: self.profile(kind='memory'))
+
+    def serve(self, port: int) -> None:
+        """
+        Start admin endpoint on localhost:
+        GET /profile?pipeline=<state key>&kind=cpu|memory&seconds=<seconds>
+        """
+        profiler = self
+
+        class AdminHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if url.path != '/profile':
+                    self.send_error(404)
+                    return
+
+                try:
+                    profiler.profile(
+                        [params['pipeline']] if 'pipeline' in params else None,
+                        kind=params.get('kind', 'cpu'),
+                        seconds=float(params['seconds']) if 'seconds' in params else None,
+                    )
+                except (KeyError, ValueError) as e:
+                    self.send_error(400, str(e))
+                    return
+
+                self.send_response(202)
+                self.end_headers()
+                self.wfile.write(f"Profiling started, results go to `{profiler.profile_dir}`\n".encode())
+
+            def log_message(self, format: str, *args) -> None:
+                logger.info("Admin request: " + format, *args)
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), AdminHandler)
+        threading.Thread(target=server.serve_forever, name='profile-admin', daemon=True).start()
+        logger.warning("Profiling admin endpoint started on: `127.0.0.1:%s`", port)
@@ -0,0 +1,136 @@
+import datetime
+
+import psycopg2
+from psycopg2.extras import DictCursor
+from pydantic import PostgresDsn
+
+from helpers.logger import LoggerFactory
+from storage_clients.postgres_client import PostgresClient
+
+logger = LoggerFactory().get_logger()
+
+# replication lag in seconds, replica time it is caught up to, and amount of active queries
+STATUS_QUERY = """
+    SELECT
+        s.lag,
+        now() - s.lag * interval '1 second' AS horizon,
+        (SELECT count(*) FROM pg_stat_activity WHERE state = 'active') AS load
+    FROM (
+        SELECT
+            CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                -- nothing to replay: replica is caught up however old the last replayed transaction is
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+            END AS lag
+    ) s;
+"""
+
+
+class ReplicaRouter:
+    """
+    Route reads of a pipe to PGSQL read replicas, replica is chosen once per produce loop.
+    Replicas lagging more than `max_lag` seconds or failing health check are skipped,
+    reads fall back to primary when no replica is left.
+    """
+    SELECTIONS = ('round_robin', 'least_loaded')
+    # replica clients give up after that many tries, so a dead replica is re-routed instead of retried forever
+    MAX_TRIES = 3
+
+    def __init__(
+        self,
+        primary: PostgresClient,
+        replica_dsns: list[PostgresDsn],
+        selection: str = 'round_robin',
+        max_lag: float = 30.0,
+        connect_timeout: int = 5,
+        **connect_kwargs,
+    ):
+        if selection not in self.SELECTIONS:
+            raise ValueError(f"Unknown replica selection: `{selection}`")
+
+        self.primary = primary
+        self.replica_dsns = replica_dsns
+        self.selection = selection
+        self.max_lag = max_lag
+        self.connect_timeout = connect_timeout
+        self.connect_kwargs = connect_kwargs
+        # health checks are run by plain connections, not to get stuck in backoff on a dead replica
+        self._probes: dict[str, psycopg2.extensions.connection] = {}
+        self._clients: dict[str, PostgresClient] = {}
+        self._turn = 0
+
+    def _status(self, dsn: str) -> dict | None:
+        try:
+            if not (probe := self._probes.get(dsn)) or probe.closed:
+                probe = self._probes[dsn] = psycopg2.connect(
+                    dsn=dsn, connect_timeout=self.connect_timeout, cursor_factory=DictCursor
+                )
+                probe.autocommit = True
+
+            with probe.cursor() as cur:
+                cur.execute(STATUS_QUERY)
+                return dict(cur.fetchone())
+        except psycopg2.Error as e:
+            logger.warning("Replica health check failed for `%s`: `%s`", dsn, str(e).strip())
+            self._probes.pop(dsn, None)
+            return None
+
+    def route(self) -> tuple[PostgresClient, datetime.datetime | None]:
+        """
+        Choose connection for the next produce loop.
+        Return it with the upper bound of `updated_at` safe to read from it, None for primary.
+        """
+        healthy = []
+        for dsn in self.replica_dsns:
+            status = self._status(dsn)
+            if status is None or status['lag'] is None:
+                continue
+
+            if status['lag'] > self.max_lag:
+                logger.warning("Replica `%s` lags `%.1f`s behind, skipping it.", dsn, status['lag'])
+                continue
+
+            healthy.append((dsn, status))
+
+        if not healthy:
+            logger.warning("No healthy replica, reading from primary.")
+            return self.primary, None
+
+        if self.selection == 'least_loaded':
+            dsn, status = min(healthy, key=lambda item: item[1]['load'])
+        else:
+            dsn, status = healthy[self._turn % len(healthy)]
+            self._turn += 1
+
+        if dsn not in self._clients:
+            try:
+                self._clients[dsn] = PostgresClient(
+                    dsn, connect_timeout=self.connect_timeout, backoff_max_tries=self.MAX_TRIES, **self.connect_kwargs
+                )
+            except psycopg2.OperationalError as e:
+                logger.warning("Replica `%s` is unreachable, reading from primary: `%s`", dsn, str(e).strip())
+                self._probes.pop(dsn, None)
+                return self.primary, None
+
+        logger.debug("Reading from replica `%s`, lag `%.1f`s.", dsn, status['lag'])
+        return self._clients[dsn], status['horizon']
+
+    def fail(self, client: PostgresClient) -> None:
+        """Drop replica connection failed in the middle of a produce loop, next `route` probes the replica again."""
+        for dsn, known in list(self._clients.items()):
+            if known is client:
+                del self._clients[dsn]
+                self._probes.pop(dsn, None)
+                try:
+                    client.rollback()
+                    client.close()
+                except psycopg2.Error:
+                    pass
+
+    def close(self) -> None:
+        for client in self._clients.values():
+            client.close()
+
+        for probe in self._probes.values():
+            probe.close()
@@ -0,0 +1,76 @@
+import contextlib
+import threading
+import time
+from typing import Callable
+
+from etl.lanes import LaneScheduler
+from helpers.logger import LoggerFactory
+from helpers.utils import peak_rss_mb
+
+logger = LoggerFactory().get_logger()
+
+
+class AdaptiveScheduler:
+    """
+    Polling loop of a pipeline: run again right away while a backlog exists,
+    back off progressively from `min_interval` up to `max_interval` while idle.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_interval: float,
+        max_interval: float,
+        factor: float = 2,
+        limiter: threading.Semaphore | None = None,
+        stop_event: threading.Event | None = None,
+        report: Callable[[dict], None] | None = None,
+        lanes: LaneScheduler | None = None,
+    ):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.factor = factor
+        # global limit of concurrently running pipelines, shared between schedulers
+        self.limiter = limiter
+        # loop is finished on this event instead of running forever
+        self.stop_event = stop_event or threading.Event()
+        # metrics of each run are passed to it
+        self.report = report
+        # priority lanes, their queue depths are reported
+        self.lanes = lanes
+        self.interval = 0.0
+
+    def next_interval(self, produced: int) -> float:
+        """Calculate sleep time before the next run by the amount of rows produced by the last one."""
+        if produced:
+            self.interval = 0.0
+        elif not self.interval:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.factor, self.max_interval)
+
+        return self.interval
+
+    def run(self, job: Callable[[], int]) -> None:
+        """Run `job` until stop event is set, `job` returns the amount of produced rows."""
+        while not self.stop_event.is_set():
+            with self.limiter or contextlib.nullcontext():
+                produced = job()
+
+            interval = self.next_interval(produced)
+            lanes = self.lanes.depths() if self.lanes else None
+            logger.debug(
+                "Pipeline `%s` produced `%s` rows, next run in `%s`s. Lanes: `%s`", self.name, produced, interval, lanes
+            )
+            if self.report:
+                self.report({
+                    "pipeline": self.name,
+                    "produced": produced,
+                    "interval": interval,
+                    "peak_rss_mb": peak_rss_mb(),
+                    "lanes": lanes,
+                    "at": time.time(),
+                })
+
+            self.stop_event.wait(interval)
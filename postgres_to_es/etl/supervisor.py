@@ -0,0 +1,184 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from typing import Any, Type
+
+from etl.etl import movie_etl
+from etl.extractors.base_filmwork_extractor import BaseFilmworkExtractor
+from etl.profiling import Profiler
+from helpers.logger import LoggerFactory
+
+logger = LoggerFactory().get_logger()
+
+
+def run_worker(
+    settings,
+    extractor_type: Type[BaseFilmworkExtractor],
+    state_key: str,
+    partition: tuple[int, int] | None,
+    log_queue: Any,
+    metrics_queue: Any,
+    limiter: Any = None,
+) -> None:
+    """Entry point of a worker process: run one pipe until SIGTERM, then checkpoint and exit."""
+    LoggerFactory().configure(level=settings.log_level, forward_queue=log_queue)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    # terminal sends SIGINT to the whole group, shutdown is driven by supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if settings.profile_signals:
+        Profiler(settings.profile_dir, settings.profile_seconds, settings.profile_interval).install_signal()
+
+    movie_etl(
+        settings,
+        extractor_type,
+        state_key,
+        limiter=limiter,
+        partition=partition,
+        stop_event=stop_event,
+        report=metrics_queue.put,
+    )
+
+
+class Worker:
+    def __init__(self, name: str, state_key: str, extractor_type: Type[BaseFilmworkExtractor], partition):
+        self.name = name
+        self.state_key = state_key
+        self.extractor_type = extractor_type
+        self.partition = partition
+        self.process: BaseProcess | None = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.restarts = 0
+
+
+class Supervisor:
+    """
+    Run each pipe, or N partitions of a pipe, in a separate process.
+    Crashed workers are restarted with exponential backoff, their logs and metrics are forwarded to supervisor.
+    On SIGTERM / SIGINT workers are asked to stop and flush their checkpoints, killed after `shutdown_timeout`.
+    """
+    # worker is considered healthy and its restart backoff is reset after running this long
+    STABLE_AFTER = 60.0
+
+    def __init__(
+        self,
+        settings,
+        pipelines: dict[str, Type[BaseFilmworkExtractor]],
+        workers: dict[str, int],
+        restart_backoff_start: float = 1.0,
+        restart_backoff_max: float = 60.0,
+        shutdown_timeout: float = 30.0,
+    ):
+        if settings.reverse_index == 'memory':
+            # links merged by one process would be missed by caches of others
+            logger.error("Memory reverse index can not be shared between worker processes, disabled. Use `redis`.")
+            settings = settings.copy(update={'reverse_index': None})
+
+        if settings.lane_capacity:
+            # every process would run a scheduler of its only pipe, with nothing to prioritize
+            logger.error("Priority lanes work between pipes of one process only, disabled in supervisor mode.")
+            settings = settings.copy(update={'lane_capacity': 0})
+
+        self.settings = settings
+        self.restart_backoff_start = restart_backoff_start
+        self.restart_backoff_max = restart_backoff_max
+        self.shutdown_timeout = shutdown_timeout
+        # spawn, not to fork threads of supervisor
+        self.context = multiprocessing.get_context('spawn')
+        self.log_queue = self.context.Queue()
+        self.metrics_queue = self.context.Queue()
+        # extract loops running at once across all worker processes
+        self.limiter = self.context.BoundedSemaphore(settings.etl_concurrency) if settings.etl_concurrency else None
+        self.metrics: dict[str, dict] = {}
+        self.stop_event = threading.Event()
+        self.workers = []
+        for state_key, extractor_type in pipelines.items():
+            count = workers.get(state_key, 1)
+            for index in range(count):
+                partition = (index, count) if count > 1 else None
+                name = f"{state_key}:{index}of{count}" if partition else state_key
+                self.workers.append(Worker(name, state_key, extractor_type, partition))
+
+    def _start(self, worker: Worker) -> None:
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(
+                self.settings, worker.extractor_type, worker.state_key, worker.partition,
+                self.log_queue, self.metrics_queue, self.limiter,
+            ),
+            name=worker.name,
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logger.warning("Worker `%s` started with pid `%s`.", worker.name, worker.process.pid)
+
+    def _check(self, worker: Worker) -> None:
+        """Restart crashed worker with backoff."""
+        now = time.monotonic()
+        if worker.process.is_alive():
+            if worker.restarts and now - worker.started_at > self.STABLE_AFTER:
+                worker.restarts = 0
+            return
+
+        if not worker.restart_at:
+            delay = min(self.restart_backoff_start * 2 ** worker.restarts, self.restart_backoff_max)
+            worker.restart_at = now + delay
+            logger.error(
+                "Worker `%s` exited with code `%s`, last metrics: `%s`. Restarting after `%s`...",
+                worker.name, worker.process.exitcode, self.metrics.get(worker.name), delay,
+            )
+        elif now >= worker.restart_at:
+            worker.restart_at = 0.0
+            worker.restarts += 1
+            self._start(worker)
+
+    def _collect_metrics(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                metrics = self.metrics_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            self.metrics[metrics["pipeline"]] = metrics
+            logger.debug("Worker metrics: `%s`", metrics)
+
+    def _shutdown(self) -> None:
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.process.terminate()  # SIGTERM: stop produce loop and checkpoint
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for worker in self.workers:
+            worker.process.join(max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                logger.error("Worker `%s` did not stop in time, killing it.", worker.name)
+                worker.process.kill()
+                worker.process.join()
+
+    def run(self) -> None:
+        """Supervise workers until SIGTERM / SIGINT, must be called from the main thread."""
+        signal.signal(signal.SIGTERM, lambda *_: self.stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop_event.set())
+
+        log_listener = LoggerFactory().listen(self.log_queue)
+        metrics_thread = threading.Thread(target=self._collect_metrics, name='metrics', daemon=True)
+        metrics_thread.start()
+
+        for worker in self.workers:
+            self._start(worker)
+        logger.critical("ETL supervisor started `%s` workers.", len(self.workers))
+
+        while not self.stop_event.wait(1):
+            for worker in self.workers:
+                self._check(worker)
+
+        logger.critical("ETL supervisor is shutting down...")
+        self._shutdown()
+        metrics_thread.join()
+        log_listener.stop()
+        logger.critical("ETL supervisor stopped.")
@@ -0,0 +1,132 @@
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+from models.filmwork import Filmwork, RawFilmwork
+
+
+class BaseDocumentTransformer(ABC):
+    """Build bulk actions of one target index from merged filmworks."""
+    mapping_file: str
+
+    def __init__(self, index: str):
+        self.index = index
+
+    @abstractmethod
+    def actions(self, rows: list[Filmwork | RawFilmwork]) -> Iterator[dict]:
+        """Actions are generated lazily, not to hold all documents of a batch in memory."""
+        raise NotImplementedError
+
+    def rename_query(self, fields: tuple[str, ...], names: dict[str, str]) -> dict | None:
+        """Update by query arguments to apply renamed objects to the index, None if not needed."""
+        return None
+
+    def rename_actions(self, fields: tuple[str, ...], names: dict[str, str]) -> list[dict]:
+        """Bulk actions to apply renamed objects to the index."""
+        return []
+
+    @staticmethod
+    def _raw(row: RawFilmwork) -> dict:
+        # complete document, raw json text is spliced into bulk body without serialization
+        return {
+            '_op_type': 'index',
+            "_id": row.id,
+            "_source": row.doc,
+        }
+
+    @staticmethod
+    def _upsert(doc: dict) -> dict:
+        return {
+            '_op_type': 'update',
+            "_id": doc["id"],
+            "doc": doc,
+            "doc_as_upsert": True
+        }
+
+
+class MovieDocumentTransformer(BaseDocumentTransformer):
+    mapping_file = 'postgres_to_es/index.json'
+
+    # updates names of nested objects by id and rebuilds related `*_names` arrays
+    RENAME_SCRIPT = """
+        for (def field : params.fields) {
+            def items = ctx._source[field];
+            if (items == null) {
+                continue;
+            }
+            def names = new ArrayList();
+            for (def item : items) {
+                if (params.names.containsKey(item.id)) {
+                    item.name = params.names[item.id];
+                }
+                names.add(item.name);
+            }
+            ctx._source[field + '_names'] = names;
+        }
+    """
+
+    def actions(self, rows: list[Filmwork | RawFilmwork]) -> Iterator[dict]:
+        return (self._raw(row) if isinstance(row, RawFilmwork) else self._upsert({
+            "id": row.id,
+            "imdb_rating": row.rating,
+            "title": row.title,
+            "description": row.description,
+            "filmwork_type": row.type,
+            "genres_names": row.genres_names,
+            "genres": [dict(genre) for genre in row.genres],
+            "directors_names": row.directors_names,
+            "actors_names": row.actors_names,
+            "writers_names": row.writers_names,
+            "directors": [dict(director) for director in row.directors],
+            "actors": [dict(actor) for actor in row.actors],
+            "writers": [dict(writer) for writer in row.writers],
+        }) for row in rows)
+
+    def rename_query(self, fields: tuple[str, ...], names: dict[str, str]) -> dict | None:
+        ids = list(names)
+        return {
+            "query": {
+                "bool": {
+                    "should": [
+                        {"nested": {"path": field, "query": {"terms": {f"{field}.id": ids}}}} for field in fields
+                    ],
+                    "minimum_should_match": 1,
+                },
+            },
+            "script": {
+                "source": self.RENAME_SCRIPT,
+                "lang": "painless",
+                "params": {"fields": list(fields), "names": names},
+            },
+        }
+
+
+class PersonDocumentTransformer(BaseDocumentTransformer):
+    mapping_file = 'postgres_to_es/persons_index.json'
+    fields = ('directors', 'actors', 'writers')
+
+    def actions(self, rows: list[Filmwork | RawFilmwork]) -> Iterator[dict]:
+        persons = {
+            person['id']: person['name'] for row in rows for field in self.fields for person in row.objects(field)
+        }
+        return iter(self.rename_actions(self.fields, persons))
+
+    def rename_actions(self, fields: tuple[str, ...], names: dict[str, str]) -> list[dict]:
+        if not set(fields) & set(self.fields):
+            return []
+
+        return [self._upsert({"id": id_, "full_name": name}) for id_, name in names.items()]
+
+
+class GenreDocumentTransformer(BaseDocumentTransformer):
+    mapping_file = 'postgres_to_es/genres_index.json'
+    fields = ('genres',)
+
+    def actions(self, rows: list[Filmwork | RawFilmwork]) -> Iterator[dict]:
+        genres = {genre['id']: genre['name'] for row in rows for genre in row.objects('genres')}
+        return iter(self.rename_actions(self.fields, genres))
+
+    def rename_actions(self, fields: tuple[str, ...], names: dict[str, str]) -> list[dict]:
+        if not set(fields) & set(self.fields):
+            return []
+
+        return [self._upsert({"id": id_, "name": name}) for id_, name in names.items()]
@@ -0,0 +1,275 @@
+import bisect
+import datetime
+import hashlib
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from psycopg2.extras import DictCursor
+
+from etl.etl import etl_pipeline, index_targets
+from etl.extractors.base_filmwork_extractor import MERGE_QUERY_TEMPLATE
+from etl.extractors.filmwork_extractor import FilmworkExtractor
+from etl.loders.sinks import make_sink
+from helpers.logger import LoggerFactory
+from models.updated_at_id import UpdatedAtId
+from storage_clients.elasticsearch_client import ElasticsearchClient
+from storage_clients.postgres_client import PostgresClient
+
+logger = LoggerFactory().get_logger()
+
+MAX_ID = 2 ** 128 - 1
+
+# document fields a fingerprint is taken of, `*_names` are derived from nested objects
+FINGERPRINT_FIELDS = ['id', 'title', 'description', 'imdb_rating', 'filmwork_type', 'genres', 'directors', 'actors',
+                      'writers']
+
+# nested objects of a merged filmwork as `id:name` list, sorted bytewise as python sorts them
+OBJECTS_SQL = """array_to_string(ARRAY(
+                SELECT (e->>'id') || ':' || (e->>'name') FROM json_array_elements(m.{field}) e ORDER BY 1 COLLATE "C"
+            ), ',')"""
+
+OBJECTS_FIELDS = ('genres', 'directors', 'actors', 'writers')
+
+# md5 of the same text `fingerprint` builds of an indexed document
+FINGERPRINT_QUERY = """
+    SELECT
+        m.id::text AS id,
+        md5(concat_ws(
+            '|',
+            m.title,
+            COALESCE(m.description, ''),
+            COALESCE(round(NULLIF(m.rating, 0)::numeric, 3)::text, ''),
+            COALESCE(m.type, ''),
+            """ + ',\n            '.join(OBJECTS_SQL.format(field=field) for field in OBJECTS_FIELDS) + """
+        )) AS fp
+    FROM (""" + MERGE_QUERY_TEMPLATE.format(condition="fw.id BETWEEN %s::uuid AND %s::uuid") + """) m
+"""
+
+# amount of filmworks in a range and md5 of their ordered fingerprints, the same `digest` calculates
+DIGEST_QUERY = """
+    SELECT
+        count(*) AS count,
+        COALESCE(md5(string_agg(f.id || ':' || f.fp, ',' ORDER BY f.id)), md5('')) AS digest
+    FROM (""" + FINGERPRINT_QUERY + """) f;
+"""
+
+
+def fingerprint(doc: dict) -> str:
+    """Fingerprint of an indexed filmwork document."""
+    def objects(items: list[dict] | None) -> str:
+        return ','.join(sorted(f"{item['id']}:{item['name']}" for item in items or [] if item.get('name') is not None))
+
+    rating = doc.get('imdb_rating')
+    text = '|'.join([
+        doc['title'],
+        doc.get('description') or '',
+        f"{rating:.3f}" if rating else '',
+        doc.get('filmwork_type') or '',
+        *(objects(doc.get(field)) for field in OBJECTS_FIELDS),
+    ])
+
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def digest(items: list[tuple[str, str]]) -> str:
+    """Digest of (id, fingerprint) pairs ordered by id."""
+    return hashlib.md5(','.join(f"{id_}:{fp}" for id_, fp in items).encode()).hexdigest()
+
+
+def split_ids(parts: int) -> list[tuple[int, int]]:
+    """Split uuid space to `parts` inclusive ranges."""
+    bounds = [(MAX_ID + 1) * i // parts for i in range(parts)] + [MAX_ID + 1]
+
+    return [(lo, hi - 1) for lo, hi in zip(bounds, bounds[1:])]
+
+
+class Throttle:
+    """Limit rate of queries shared by verifier workers, 0 means no limit."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+
+        time.sleep(at - now)
+
+
+class Drift:
+    def __init__(self):
+        # in PGSQL, not in index
+        self.missing: list[str] = []
+        # in both, documents differ
+        self.stale: list[str] = []
+        # in index, not in PGSQL
+        self.orphaned: list[str] = []
+
+    def update(self, other: "Drift") -> None:
+        self.missing += other.missing
+        self.stale += other.stale
+        self.orphaned += other.orphaned
+
+    def __repr__(self):
+        return f"missing: {len(self.missing)}, stale: {len(self.stale)}, orphaned: {len(self.orphaned)}"
+
+
+class RangeVerifier:
+    """
+    Compare filmworks of an id range in PGSQL and in the index by digests of document fingerprints.
+    Index range is scanned once, PGSQL digests are calculated server side.
+    Mismatched ranges are bisected until they are small enough to compare fingerprints id by id.
+    """
+
+    def __init__(
+        self,
+        pg_conn: PostgresClient,
+        elk_conn: ElasticsearchClient,
+        index: str,
+        throttle: Throttle,
+        leaf_size: int = 1000,
+        page_size: int = 1000,
+    ):
+        self.pg_conn = pg_conn
+        self.elk_conn = elk_conn
+        self.index = index
+        self.throttle = throttle
+        self.leaf_size = leaf_size
+        self.page_size = page_size
+
+    def _pg_digest(self, lo: str, hi: str) -> tuple[int, str]:
+        self.throttle.wait()
+        with self.pg_conn.cursor() as cur:
+            cur.execute(DIGEST_QUERY, [lo, hi])
+            result = cur.fetchmany(1)[0]
+
+        return result['count'], result['digest']
+
+    def _pg_fingerprints(self, lo: str, hi: str) -> dict[str, str]:
+        self.throttle.wait()
+        with self.pg_conn.cursor() as cur:
+            cur.execute(FINGERPRINT_QUERY, [lo, hi])
+            fingerprints = {}
+            while results := cur.fetchmany(self.page_size):
+                fingerprints.update((result['id'], result['fp']) for result in results)
+
+        return fingerprints
+
+    def _es_fingerprints(self, lo: str, hi: str) -> list[tuple[str, str]]:
+        """Scan index range sorted by id with `search_after`."""
+        fingerprints = []
+        search_after = None
+        while True:
+            self.throttle.wait()
+            response = self.elk_conn.search(
+                self.index,
+                query={"range": {"id": {"gte": lo, "lte": hi}}},
+                sort=[{"id": "asc"}],
+                source=FINGERPRINT_FIELDS,
+                size=self.page_size,
+                track_total_hits=False,
+                **({"search_after": search_after} if search_after else {}),
+            )
+            hits = response["hits"]["hits"]
+            fingerprints += [(hit["_source"]["id"], fingerprint(hit["_source"])) for hit in hits]
+            if len(hits) < self.page_size:
+                return fingerprints
+
+            search_after = hits[-1]["sort"]
+
+    def _bisect(self, lo: int, hi: int, es_items: list[tuple[str, str]]) -> Drift:
+        lo_id, hi_id = str(uuid.UUID(int=lo)), str(uuid.UUID(int=hi))
+        ids = [id_ for id_, _ in es_items]
+        es_items = es_items[bisect.bisect_left(ids, lo_id):bisect.bisect_right(ids, hi_id)]
+        drift = Drift()
+
+        count, pg_digest = self._pg_digest(lo_id, hi_id)
+        if count == len(es_items) and pg_digest == digest(es_items):
+            return drift
+
+        if count + len(es_items) <= self.leaf_size or lo == hi:
+            pg_items = self._pg_fingerprints(lo_id, hi_id)
+            es_map = dict(es_items)
+            drift.missing = [id_ for id_ in pg_items if id_ not in es_map]
+            drift.stale = [id_ for id_, fp in pg_items.items() if id_ in es_map and es_map[id_] != fp]
+            drift.orphaned = [id_ for id_ in es_map if id_ not in pg_items]
+            return drift
+
+        mid = (lo + hi) // 2
+        drift.update(self._bisect(lo, mid, es_items))
+        drift.update(self._bisect(mid + 1, hi, es_items))
+
+        return drift
+
+    def verify(self, lo: int, hi: int) -> Drift:
+        return self._bisect(lo, hi, self._es_fingerprints(str(uuid.UUID(int=lo)), str(uuid.UUID(int=hi))))
+
+
+def requeue(settings, ids: list[str], orphaned: list[str]) -> None:
+    """Rebuild documents of `ids` by the filmwork pipe, delete `orphaned` ones from filmworks index."""
+    if ids:
+        with etl_pipeline(settings, FilmworkExtractor, 'verify-rebuild') as extractor:
+            pipe = extractor._enrich()
+            pipe.send(None)
+            now = datetime.datetime.now()
+            for i in range(0, len(ids), settings.extract_chunk):
+                pipe.send((now, [UpdatedAtId(id=id_, updated_at=now) for id_ in ids[i:i + settings.extract_chunk]]))
+            pipe.close()
+            extractor.finish_pipe()
+
+    if orphaned:
+        with closing(make_sink(settings, 'verify-delete')) as sink:
+            sink.bulk(index_targets(settings)[0].index, ({'_op_type': 'delete', '_id': id_} for id_ in orphaned))
+            sink.checkpoint()
+
+
+def verify(settings, parts: int, workers: int, rate: float, leaf_size: int, dry_run: bool = False) -> Drift:
+    """
+    Find filmworks missing, stale or orphaned in the index by `parts` id ranges verified by `workers` in parallel,
+    queries of all workers are limited to `rate` per second. Rebuild and delete found documents unless `dry_run`.
+    """
+    started = time.monotonic()
+    throttle = Throttle(rate)
+    ranges = queue.Queue()
+    for id_range in split_ids(parts):
+        ranges.put(id_range)
+
+    def work() -> Drift:
+        found = Drift()
+        with closing(PostgresClient(settings.pg_dsn, cursor_factory=DictCursor)) as pg_conn, \
+                closing(ElasticsearchClient(settings.elk_dsn)) as elk_conn:
+            verifier = RangeVerifier(pg_conn, elk_conn, settings.elk_index, throttle, leaf_size=leaf_size)
+            while True:
+                try:
+                    lo, hi = ranges.get_nowait()
+                except queue.Empty:
+                    return found
+
+                drift = verifier.verify(lo, hi)
+                if drift.missing or drift.stale or drift.orphaned:
+                    logger.warning("Drift in range `%s`: `%r`", uuid.UUID(int=lo), drift)
+                found.update(drift)
+
+    drift = Drift()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(work) for _ in range(workers)]:
+            drift.update(future.result())
+
+    logger.critical("Verification finished in `%.1f`s: `%r`", time.monotonic() - started, drift)
+    if not dry_run:
+        requeue(settings, drift.missing + drift.stale, drift.orphaned)
+        logger.critical("Requeued `%s` documents, deleted `%s` orphaned.", len(drift.missing + drift.stale),
+                        len(drift.orphaned))
+
+    return drift
@@ -40,24 +40,35 @@ def backoff(
     :param border_sleep_time: граничное время ожидания
     :return: результат выполнения функции
 
+    Если у клиента (первый аргумент) задан `backoff_max_tries`, после стольких попыток исключение пробрасывается.
+
     """
 
     def func_wrapper(func: Callable):
         @wraps(func)
         def inner(*args, **kwargs):
+            max_tries = getattr(args[0], 'backoff_max_tries', None) if args else None
             try:
                 return func(*args, **kwargs)
             except exceptions as e:
+                if max_tries is not None and max_tries <= 1:
+                    raise
+
                 logger.error(
                     "Call: `%s` failed with `%s`. Going for backoff...",
                     func.__name__, str(e)
                 )
                 t = start_sleep_time
                 n = 0
+                tries = 1
                 while True:
                     try:
                         return func(*args, **kwargs)
                     except exceptions as e:
+                        tries += 1
+                        if max_tries is not None and tries >= max_tries:
+                            raise
+
                         if t < border_sleep_time:
                             # not to calc exp to inf
                             t = t * factor ** n
@@ -6,3 +6,8 @@ class ElasticsearchNotConnectedError(ConnectionError):
 class RedisNotConnectedError(ConnectionError):
     """Redis client is lazy, throw this `e` if connection was not established."""
     pass
+
+
+class LeaseLostError(RuntimeError):
+    """Lease of a pipe expired or was taken over, its holder must not write state any more."""
+    pass
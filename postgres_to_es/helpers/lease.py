@@ -0,0 +1,81 @@
+from storage_clients.redis_client import RedisClient
+
+# prolong lease only if it is still held by the caller
+RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+"""
+
+# release lease only if it is still held by the caller
+RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+"""
+
+# write value only while lease is held by the caller, so the write can not race with the next holder
+FENCED_SET_SCRIPT = """
+    if redis.call('GET', KEYS[2]) == ARGV[2] then
+        redis.call('SET', KEYS[1], ARGV[1])
+        return 1
+    end
+    return 0
+"""
+
+
+class Lease:
+    """
+    Exclusive right of one ETL instance to run a pipe, kept in Redis with TTL and prolonged by heartbeats.
+    Lease of a dead instance expires and is taken by another one.
+    Every acquisition gets a new fencing token, state writes are accepted only with the current one.
+    """
+
+    def __init__(self, redis_adapter: RedisClient, name: str, owner: str, ttl: float):
+        self.redis_adapter = redis_adapter
+        self.name = name
+        self.owner = owner
+        self.ttl_ms = int(ttl * 1000)
+        self.token: int | None = None
+
+    @property
+    def key(self) -> str:
+        return f"lease:{self.name}"
+
+    @property
+    def value(self) -> str:
+        return f"{self.owner}:{self.token}"
+
+    def acquire(self) -> bool:
+        """Try to take free lease."""
+        if self.redis_adapter.exists(self.key):
+            return False
+
+        self.token = self.redis_adapter.execute_pipeline([('incr', f"{self.key}:token")])[0]
+        if self.redis_adapter.set(self.key, self.value, nx=True, px=self.ttl_ms):
+            return True
+
+        self.token = None
+        return False
+
+    def renew(self) -> bool:
+        """Heartbeat: prolong lease, False if it was lost."""
+        if self.token is None:
+            return False
+
+        if self.redis_adapter.execute_script(RENEW_SCRIPT, [self.key], [self.value, self.ttl_ms]):
+            return True
+
+        self.token = None
+        return False
+
+    def release(self) -> None:
+        if self.token is not None:
+            self.redis_adapter.execute_script(RELEASE_SCRIPT, [self.key], [self.value])
+            self.token = None
+
+    def fenced_set(self, key: str, value: str) -> bool:
+        """Set `key` only while lease is held, False if it was lost."""
+        return bool(self.redis_adapter.execute_script(FENCED_SET_SCRIPT, [key, self.key], [value, self.value]))
@@ -1,35 +1,106 @@
-import copy
+import atexit
+import json
 import logging.config
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Any
 
 from helpers.utils import SingletonType
 
 
 class ColoredConsoleHandler(logging.StreamHandler):
-    def emit(self, record):
-        # Need to make a actual copy of the record
-        # to prevent altering the message for other loggers
-        current_record = copy.copy(record)
-        level = current_record.levelno
-        if level >= 50:  # CRITICAL / FATAL
-            color = '\x1b[31m'  # red
-        elif level >= 40:  # ERROR
-            color = '\x1b[31m'  # red
-        elif level >= 30:  # WARNING
-            color = '\x1b[33m'  # yellow
-        elif level >= 20:  # INFO
-            color = '\x1b[32m'  # green
-        elif level >= 10:  # DEBUG
-            color = '\x1b[35m'  # pink
-        else:  # NOTSET and anything else
-            color = '\x1b[0m'  # normal
-
-        current_record.msg = color + str(current_record.msg) + '\x1b[0m'  # normal
-        current_record.levelname = color + str(current_record.levelname) + '\x1b[0m'  # normal
-        logging.StreamHandler.emit(self, current_record)
+    COLORS = (
+        (50, '\x1b[31m'),  # CRITICAL / FATAL: red
+        (40, '\x1b[31m'),  # ERROR: red
+        (30, '\x1b[33m'),  # WARNING: yellow
+        (20, '\x1b[32m'),  # INFO: green
+        (10, '\x1b[35m'),  # DEBUG: pink
+    )
+    RESET = '\x1b[0m'  # normal
+
+    def format(self, record: logging.LogRecord) -> str:
+        # colorize formatted line instead of copying and altering the record,
+        # so other handlers receive it untouched
+        color = next((color for level, color in self.COLORS if record.levelno >= level), self.RESET)
+        return color + super().format(record) + self.RESET
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors in production."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Pass at most `burst` records from the same call site per `period` seconds.
+    Number of dropped records is reported with the first record of the next period.
+    """
+
+    def __init__(self, burst: int, period: float):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._lock = threading.Lock()
+        self._windows: dict[tuple[str, int], list[float | int]] = {}  # site: [started, passed, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+
+        with self._lock:
+            window = self._windows.get(site)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                self._windows[site] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+                return True
+
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+
+            window[2] += 1
+            return False
+
+
+class ThreadQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # queue is consumed by a thread of this process: no need to pickle the record,
+        # formatting is done by the listener, not by the pipeline thread
+        return record
+
+
+class ForwardedRecordHandler(logging.Handler):
+    """Pass records received from worker processes to handlers of the application logger."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        LoggerFactory().get_logger().handle(record)
 
 
 class LoggerFactory(metaclass=SingletonType):
     _logger = None
+    _listener: logging.handlers.QueueListener | None = None
 
     LOGGER_NAME = "app_logger"
     LOGGER_CONFIG = {
@@ -63,3 +134,60 @@ class LoggerFactory(metaclass=SingletonType):
 
     def get_logger(self):
         return self._logger
+
+    def configure(
+        self,
+        level: str = "INFO",
+        json_format: bool = False,
+        use_queue: bool = True,
+        rate_limit_burst: int = 0,
+        rate_limit_period: float = 60.0,
+        forward_queue: Any = None,
+    ) -> None:
+        """
+        Reconfigure application logger in place, loggers obtained before stay valid.
+        With `use_queue` records are written to stderr by a background listener thread.
+        With `forward_queue` records are sent to a parent process, see `listen`.
+        """
+        for old_handler in self._logger.handlers[:]:
+            self._logger.removeHandler(old_handler)
+            old_handler.close()
+        self.stop()
+
+        if forward_queue is not None:
+            # default `prepare` makes records picklable
+            handler = logging.handlers.QueueHandler(forward_queue)
+        elif json_format:
+            handler = logging.StreamHandler()
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler = ColoredConsoleHandler()
+            handler.setFormatter(logging.Formatter(self.LOGGER_CONFIG["formatters"]["default_formatter"]["format"]))
+
+        if use_queue and forward_queue is None:
+            log_queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+            self._listener.start()
+            handler = ThreadQueueHandler(log_queue)
+
+        if rate_limit_burst > 0:
+            # filter before enqueueing, dropped records cost nothing to the listener
+            handler.addFilter(RateLimitFilter(rate_limit_burst, rate_limit_period))
+
+        self._logger.addHandler(handler)
+        self._logger.setLevel(level.upper())
+
+    def listen(self, forward_queue: Any) -> logging.handlers.QueueListener:
+        """Start handling records forwarded by worker processes to `forward_queue`."""
+        listener = logging.handlers.QueueListener(forward_queue, ForwardedRecordHandler())
+        listener.start()
+        return listener
+
+    def stop(self) -> None:
+        """Flush queued records and stop the listener thread."""
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+
+
+atexit.register(lambda: LoggerFactory().stop())
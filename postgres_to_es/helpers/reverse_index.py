@@ -0,0 +1,129 @@
+import collections
+import threading
+from abc import ABC, ABCMeta, abstractmethod
+
+from helpers.utils import SingletonType
+from storage_clients.redis_client import RedisClient
+
+# add filmworks to sets that exist only, atomically: a set expired in between must not be recreated partial.
+# ARGV holds, for each key, amount of its filmworks followed by them; SADD keeps expiry of a set
+ADD_LINKS_SCRIPT = """
+    local pos = 1
+    for _, key in ipairs(KEYS) do
+        local count = tonumber(ARGV[pos])
+        if redis.call('EXISTS', key) == 1 then
+            for i = pos + 1, pos + count do
+                redis.call('SADD', key, ARGV[i])
+            end
+        end
+        pos = pos + count + 1
+    end
+    return 1
+"""
+
+# document fields holding linked objects of each kind
+LINK_FIELDS = {
+    'person': ('directors', 'actors', 'writers'),
+    'genre': ('genres',),
+}
+
+
+class BaseReverseIndex(ABC):
+    """
+    Cache of filmwork ids linked to a person or a genre.
+    Entry is created from PGSQL on a miss and then kept up to date with links of merged filmworks.
+    Links removed from a filmwork may stay in entries: that costs an extra rebuild, never a missed one.
+    """
+
+    @abstractmethod
+    def get(self, kind: str, ids: list[str]) -> dict[str, set[str]]:
+        """Return linked filmworks of cached objects, missing objects are not in result."""
+        pass
+
+    @abstractmethod
+    def put(self, kind: str, entries: dict[str, set[str]]) -> None:
+        """Cache complete sets of linked filmworks."""
+        pass
+
+    @abstractmethod
+    def add_links(self, kind: str, links: dict[str, set[str]]) -> None:
+        """Add filmworks to cached objects, objects not in cache are skipped."""
+        pass
+
+
+class SingletonABCMeta(SingletonType, ABCMeta):
+    pass
+
+
+class MemoryReverseIndex(BaseReverseIndex, metaclass=SingletonABCMeta):
+    """Process wide LRU cache, shared by pipelines running in threads of one process."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: collections.OrderedDict[tuple[str, str], set[str]] = collections.OrderedDict()
+
+    def get(self, kind: str, ids: list[str]) -> dict[str, set[str]]:
+        result = {}
+        with self._lock:
+            for id_ in ids:
+                if (films := self._entries.get((kind, id_))) is not None:
+                    self._entries.move_to_end((kind, id_))
+                    result[id_] = set(films)
+
+        return result
+
+    def put(self, kind: str, entries: dict[str, set[str]]) -> None:
+        with self._lock:
+            for id_, films in entries.items():
+                self._entries[(kind, id_)] = set(films)
+                self._entries.move_to_end((kind, id_))
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add_links(self, kind: str, links: dict[str, set[str]]) -> None:
+        with self._lock:
+            for id_, films in links.items():
+                if (cached := self._entries.get((kind, id_))) is not None:
+                    cached.update(films)
+
+
+class RedisReverseIndex(BaseReverseIndex):
+    """Cache in Redis sets shared by all pipelines and processes, entries expire after `ttl` seconds."""
+    # member of every set: empty set of an object without filmworks is still cached
+    MARKER = ''
+
+    def __init__(self, redis_adapter: RedisClient, ttl: int):
+        self.redis_adapter = redis_adapter
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(kind: str, id_: str) -> str:
+        return f"reverse_index:{kind}:{id_}"
+
+    def get(self, kind: str, ids: list[str]) -> dict[str, set[str]]:
+        results = self.redis_adapter.execute_pipeline([('smembers', self._key(kind, id_)) for id_ in ids])
+        return {
+            id_: {film.decode() for film in films} - {self.MARKER}
+            for id_, films in zip(ids, results) if films
+        }
+
+    def put(self, kind: str, entries: dict[str, set[str]]) -> None:
+        commands = []
+        for id_, films in entries.items():
+            key = self._key(kind, id_)
+            commands += [('delete', key), ('sadd', key, self.MARKER, *films), ('expire', key, self.ttl)]
+
+        if commands:
+            self.redis_adapter.execute_pipeline(commands)
+
+    def add_links(self, kind: str, links: dict[str, set[str]]) -> None:
+        if not links:
+            return
+
+        args = []
+        for films in links.values():
+            args += [len(films), *films]
+
+        self.redis_adapter.execute_script(ADD_LINKS_SCRIPT, [self._key(kind, id_) for id_ in links], args)
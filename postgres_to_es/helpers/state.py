@@ -1,6 +1,8 @@
 import json
 from abc import abstractmethod, ABC
 
+from helpers.exceptions import LeaseLostError
+from helpers.lease import Lease
 from models.state import StateModel
 from storage_clients.redis_client import RedisClient
 
@@ -41,6 +43,18 @@ class RedisStorage(BaseStorage):
         return result
 
 
+class FencedRedisStorage(RedisStorage):
+    """Redis storage writing state only while the lease of the pipe is held."""
+
+    def __init__(self, redis_adapter: RedisClient, lease: Lease):
+        super().__init__(redis_adapter)
+        self.lease = lease
+
+    def save_state(self, key: str, value: object) -> None:
+        if not self.lease.fenced_set(key, json.dumps(value)):
+            raise LeaseLostError(f"Lease `{self.lease.name}` is lost, state `{key}` is not saved")
+
+
 class State:
     def __init__(self, storage: BaseStorage, key: str):
         self.storage = storage
@@ -1,3 +1,6 @@
+import resource
+
+
 class SingletonType(type):
     _instances = {}
 
@@ -5,3 +8,8 @@ class SingletonType(type):
         if cls not in cls._instances:
             cls._instances[cls] = super(SingletonType, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the process in megabytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
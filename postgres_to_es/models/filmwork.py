@@ -1,3 +1,5 @@
+import json
+
 from models.mixins import IdMixIn
 
 
@@ -27,9 +29,35 @@ class Filmwork(IdMixIn):
     def _get_names(objects: list[Person] | list[Genre]):
         return [x.name for x in objects]
 
+    def objects(self, field: str) -> list[dict]:
+        return [dict(x) for x in getattr(self, field)]
+
     def transform(self) -> None:
         self.genres_names = self._get_names(self.genres)
         self.directors_names = self._get_names(self.directors)
         self.actors_names = self._get_names(self.actors)
         self.writers_names = self._get_names(self.writers)
         self.rating = float(self.rating) if self.rating else None
+
+
+class RawFilmwork(IdMixIn):
+    """
+    Filmwork document assembled by PGSQL, `doc` is raw json text to be passed to ELK as is.
+    Nested objects come as separate columns, decoded by PGSQL driver or as json text decoded on first use,
+    `doc` is never decoded.
+    """
+    doc: str
+    genres: list[dict] | str
+    directors: list[dict] | str
+    actors: list[dict] | str
+    writers: list[dict] | str
+
+    def transform(self) -> None:
+        pass
+
+    def objects(self, field: str) -> list[dict]:
+        if isinstance(objects := getattr(self, field), str):
+            objects = json.loads(objects)
+            setattr(self, field, objects)
+
+        return objects
@@ -0,0 +1,104 @@
+from pydantic import BaseSettings, PostgresDsn, RedisDsn, AnyHttpUrl, conint
+
+
+class Settings(BaseSettings):
+    pg_dsn: PostgresDsn
+    extract_chunk: int
+    # run enrich and merge queries as prepared statements, not in streaming mode
+    pg_prepare: bool = False
+    # make PGSQL always use generic plans of prepared statements
+    pg_force_generic_plan: bool = False
+    # read replicas, produce, enrich and merge reads are routed to them
+    pg_replica_dsns: list[PostgresDsn] = []
+    # `round_robin` or `least_loaded` by active queries
+    pg_replica_selection: str = 'round_robin'
+    # replicas lagging more seconds are skipped, reads fall back to primary if none is left
+    pg_replica_max_lag: float = 30.0
+    pg_replica_connect_timeout: int = 5
+    redis_dsn: RedisDsn
+    elk_dsn: AnyHttpUrl
+    elk_index: str
+    elk_persons_index: str | None = None
+    elk_genres_index: str | None = None
+    load_chunk: int
+    load_max_chunk_bytes: int = 100 * 1024 * 1024
+    # `elasticsearch` or `file`: NDJSON files in `_bulk` format for offline import
+    sink: str = 'elasticsearch'
+    sink_dir: str = 'bulk'
+    # `gzip`, `zstd` or empty for no compression
+    sink_compression: str | None = None
+    # uncompressed size to rotate files at
+    sink_max_file_bytes: int = 1024 ** 3
+    sink_buffer_bytes: int = 8 * 1024 ** 2
+    # fetch rows by server side cursors, not to hold whole query results in memory
+    stream_mode: bool = False
+    # max documents in flight per pipeline, 0 means `extract_chunk`
+    max_inflight_docs: int = 0
+    # max bytes of merged documents in flight per pipeline, 0 means no limit
+    max_inflight_bytes: int = 0
+    # documents are assembled by PGSQL and loaded as raw json text
+    passthrough: bool = False
+    # cache of filmwork ids by person / genre id: `redis`, `memory` (per process) or empty to disable
+    reverse_index: str | None = None
+    # entries of memory cache
+    reverse_index_max_entries: int = 100_000
+    # seconds redis cache entries live before they are queried from PGSQL again
+    reverse_index_ttl: int = 24 * 60 * 60
+    # update renamed persons and genres in place instead of rebuilding their films
+    rename_fanout: bool = False
+    # seconds update by query task of a rename may run, then it is cancelled and documents are rebuilt
+    rename_timeout: float = 600.0
+    log_level: str = 'INFO'
+    log_json: bool = False
+    log_queue: bool = True
+    log_rate_limit_burst: int = 10
+    log_rate_limit_period: float = 60.0
+    poll_min_interval: float = 1.0
+    poll_max_interval: float = 60.0
+    poll_backoff_factor: float = 2.0
+    # per pipeline (min, max) poll intervals by state key, e.g. {"genre_data": [5, 300]}
+    poll_intervals: dict[str, tuple[float, float]] = {}
+    # max pipelines running extraction at the same time, 0 means no limit
+    etl_concurrency: int = 0
+    # batches merged and loaded at the same time by pipes of a process, 0 disables priority lanes
+    lane_capacity: int = 0
+    # seconds a lower priority batch may wait before it is served first
+    lane_max_wait: float = 5.0
+    # fan-out of a produced batch to more filmworks goes to `bulk` lane
+    lane_small_fanout: int = 1000
+    # trace time from PGSQL `updated_at` to searchable document per batch
+    freshness_tracing: bool = False
+    # fraction of loaded documents read back until they are searchable
+    freshness_sample_rate: float = 0.01
+    # seconds, alert is logged when `freshness_slo_percentile` of freshness exceeds it
+    freshness_slo: float = 60.0
+    # percentile the SLO is checked at, `statistics.quantiles` cuts only 1..99
+    freshness_slo_percentile: conint(ge=1, le=99) = 95
+    # batches percentiles are calculated over
+    freshness_window: int = 1000
+    freshness_report_interval: float = 60.0
+    freshness_visibility_timeout: float = 60.0
+    profile_dir: str = '/tmp/etl_profiles'
+    profile_seconds: float = 30.0
+    profile_interval: float = 0.005
+    # profile all pipelines on SIGUSR1 (cpu) and SIGUSR2 (memory)
+    profile_signals: bool = True
+    # local admin endpoint port, 0 disables it
+    profile_admin_port: int = 0
+    # run every pipe in a separate supervised process instead of a thread
+    supervisor: bool = False
+    # worker processes per pipe by state key, pipe is split between them by id hash, e.g. {"person_data": 2}
+    pipeline_workers: dict[str, int] = {}
+    # share pipes, split by `pipeline_workers`, between ETL instances by Redis leases
+    lease: bool = False
+    # lease of a dead instance is taken over after this many seconds
+    lease_ttl: float = 30.0
+    lease_heartbeat: float = 10.0
+    restart_backoff_start: float = 1.0
+    restart_backoff_max: float = 60.0
+    shutdown_timeout: float = 30.0
+
+    class Config:
+        case_sensitive = False
+        env_file = '.env'
+        env_file_encoding = 'utf-8'
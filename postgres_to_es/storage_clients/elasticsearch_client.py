@@ -1,5 +1,8 @@
+import itertools
+from typing import Iterable
+
 import elastic_transport
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import Elasticsearch, NotFoundError, helpers
 from pydantic import AnyHttpUrl
 
 from storage_clients.base_client import AbstractStorage
@@ -56,9 +59,34 @@ class ElasticsearchClient(AbstractStorage):
 
     @backoff(exceptions=(base_exceptions, elastic_transport.SerializationError))
     @storage_reconnect
-    def chunked_bulk(self, actions: list, chunk_size: int, *args, **kwargs) -> None:
-        def split(a, n):
-            return (a[i:i + n] for i in range(0, len(a), n))
+    def get(self, index: str, id_: str, **kwargs) -> dict | None:
+        try:
+            return dict(self._connection.get(index=index, id=id_, **kwargs))
+        except NotFoundError:
+            return None
+
+    @backoff(exceptions=(base_exceptions, elastic_transport.SerializationError))
+    @storage_reconnect
+    def search(self, index: str, **kwargs) -> dict:
+        return dict(self._connection.search(index=index, **kwargs))
+
+    @backoff(exceptions=(base_exceptions, elastic_transport.SerializationError))
+    @storage_reconnect
+    def update_by_query(self, index: str, *args, **kwargs) -> dict:
+        return dict(self._connection.update_by_query(index=index, *args, **kwargs))
+
+    @backoff(exceptions=(base_exceptions, elastic_transport.SerializationError))
+    @storage_reconnect
+    def get_task(self, task_id: str) -> dict:
+        return dict(self._connection.tasks.get(task_id=task_id))
 
-        for action_chunk in split(actions, chunk_size):
-            helpers.bulk(self._connection, actions=action_chunk, *args, **kwargs)
+    @backoff(exceptions=(base_exceptions, elastic_transport.SerializationError))
+    @storage_reconnect
+    def cancel_task(self, task_id: str) -> None:
+        self._connection.tasks.cancel(task_id=task_id)
+
+    def chunked_bulk(self, actions: Iterable[dict], chunk_size: int, *args, **kwargs) -> None:
+        """Consume actions lazily, only one chunk is held in memory and resent on failure."""
+        actions = iter(actions)
+        while action_chunk := list(itertools.islice(actions, chunk_size)):
+            self.bulk(actions=action_chunk, chunk_size=chunk_size, *args, **kwargs)
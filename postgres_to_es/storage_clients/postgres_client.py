@@ -18,7 +18,11 @@ class PostgresClient(AbstractStorage):
     base_exceptions = psycopg2.OperationalError
     _connection: pg_conn
 
-    def __init__(self, dsn: PostgresDsn, *args, **kwargs):
+    def __init__(self, dsn: PostgresDsn, *args, backoff_max_tries: int | None = None, **kwargs):
+        # names of statements prepared on current connection
+        self.prepared: set[str] = set()
+        # calls of this client and its cursors give up after that many tries, None means retry forever
+        self.backoff_max_tries = backoff_max_tries
         super().__init__(dsn, *args, **kwargs)
 
     @property
@@ -28,12 +32,15 @@ class PostgresClient(AbstractStorage):
     @backoff(exceptions=base_exceptions)
     def connect(self) -> None:
         self._connection = psycopg2.connect(dsn=self.dsn, *self.args, **self.kwargs)
+        # prepared statements live as long as connection does
+        self.prepared = set()
         logger.info("Established new connection for: `%r.", self)
 
     @backoff(exceptions=base_exceptions)
     @contextlib.contextmanager
-    def cursor(self) -> "PostgresCursor":
-        cursor: PostgresCursor = PostgresCursor(self)
+    def cursor(self, name: str | None = None) -> "PostgresCursor":
+        """Named cursor is a server side one: rows are fetched from the server by `fetchmany` chunks."""
+        cursor: PostgresCursor = PostgresCursor(self, name)
 
         yield cursor
 
@@ -42,6 +49,11 @@ class PostgresClient(AbstractStorage):
     def reconnect(self) -> None:
         super().reconnect()
 
+    def rollback(self) -> None:
+        """Abort current transaction, failed one blocks every next query of the connection."""
+        if self.is_connected:
+            self._connection.rollback()
+
     @backoff(exceptions=base_exceptions)
     def close(self) -> None:
         super().close()
@@ -53,11 +65,17 @@ class PostgresCursor(AbstractClientInterface):
 
     def __init__(self, connection: PostgresClient, *args, **kwargs):
         self._connection = connection
-        self.connect(*args, **kwargs)
+        self.args = args
+        self.kwargs = kwargs
+        self.connect()
 
     def __repr__(self):
         return f"Postgres cursor with connection dsn: {self._connection.dsn}"
 
+    @property
+    def backoff_max_tries(self) -> int | None:
+        return self._connection.backoff_max_tries
+
     @property
     def is_cursor_opened(self) -> bool:
         return self._cursor and not self._cursor.closed
@@ -71,9 +89,9 @@ class PostgresCursor(AbstractClientInterface):
         return self.is_connection_opened and self.is_cursor_opened
 
     @backoff(exceptions=base_exceptions)
-    def connect(self, *args, **kwargs) -> None:
+    def connect(self) -> None:
         # noinspection PyProtectedMember
-        self._cursor: pg_cursor = self._connection._connection.cursor(*args, **kwargs)
+        self._cursor: pg_cursor = self._connection._connection.cursor(*self.args, **self.kwargs)
         logger.debug("Created new cursor for: `%r.", self)
 
     def reconnect(self) -> None:
@@ -96,6 +114,23 @@ class PostgresCursor(AbstractClientInterface):
     def execute(self, query: str | SQL, *args, **kwargs) -> None:
         self._cursor.execute(query, *args, **kwargs)
 
+    @backoff(exceptions=(base_exceptions, psycopg2.DatabaseError))
+    @storage_reconnect
+    def execute_prepared(self, name: str, query: str, params: list, types: list[str]) -> None:
+        """
+        Execute query as server side prepared statement, statement is prepared on first use on each connection.
+        Query placeholders are `%s`, they are passed to PGSQL as `$n` parameters of PGSQL `types`.
+        """
+        if name not in self._connection.prepared:
+            parts = query.split('%s')
+            statement = ''.join(f"{part}${n}" for n, part in enumerate(parts[:-1], start=1)) + parts[-1]
+            self._cursor.execute(f"PREPARE {name} ({', '.join(types)}) AS {statement.replace('%%', '%')}")
+            self._connection.prepared.add(name)
+            logger.debug("Prepared statement `%s` for: `%r`.", name, self)
+
+        # params are cast explicitly, psycopg2 sends lists as text arrays
+        self._cursor.execute(f"EXECUTE {name} ({', '.join(f'%s::{type_}' for type_ in types)})", params)
+
     @backoff(exceptions=(base_exceptions, psycopg2.DatabaseError))
     @storage_reconnect
     def fetchmany(self, chunk: int) -> list[Any]:
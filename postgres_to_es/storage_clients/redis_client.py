@@ -1,3 +1,5 @@
+from typing import Any
+
 import redis.exceptions
 from pydantic import RedisDsn
 from redis.client import Redis
@@ -74,3 +76,19 @@ class RedisClient(AbstractStorage):
     @storage_reconnect
     def set(self, name: KeyT, value: EncodableT, *args, **kwargs) -> None:
         return self._connection.set(name, value, *args, **kwargs)
+
+    @backoff(exceptions=base_exceptions)
+    @storage_reconnect
+    def execute_pipeline(self, commands: list[tuple]) -> list:
+        """Send commands in one round trip, commands are `(name, *args)`, must be safe to retry."""
+        pipe = self._connection.pipeline(transaction=False)
+        for name, *args in commands:
+            getattr(pipe, name)(*args)
+
+        return pipe.execute()
+
+    @backoff(exceptions=base_exceptions)
+    @storage_reconnect
+    def execute_script(self, script: str, keys: list[KeyT], args: list[EncodableT]) -> Any:
+        """Run Lua script atomically, script must be safe to retry."""
+        return self._connection.eval(script, len(keys), *keys, *args)